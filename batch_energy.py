@@ -0,0 +1,41 @@
+import numpy as np
+
+# Scores many orderings at once. Orderings are rows of wizard ids (ordering[i]
+# is the wizard at position i) and constraints are the (m x 3) integer array
+# of (a, b, middle) rows that instance_loader produces.
+
+def constraint_array(constraints):
+    # Turns a list of (a, b, middle) tuples into the (m x 3) array.
+    return np.asarray(constraints, dtype = np.int32).reshape(-1, 3)
+
+def positions(orderings):
+    # Inverse permutations: positions[r, w] is the position of wizard w in
+    # ordering r.
+    orderings = np.atleast_2d(np.asarray(orderings))
+    result = np.empty(orderings.shape, dtype = np.int32)
+    np.put_along_axis(result, orderings, np.arange(orderings.shape[1], dtype = np.int32)[np.newaxis, :], axis = 1)
+    return result
+
+def violated_masks(orderings, constraints):
+    # (k x m) boolean array: True where ordering r violates constraint i.
+    pos = positions(orderings)
+    a = pos[:, constraints[:, 0]]
+    b = pos[:, constraints[:, 1]]
+    mid = pos[:, constraints[:, 2]]
+    return ((a < mid) & (mid < b)) | ((b < mid) & (mid < a))
+
+def violation_counts(orderings, constraints, masks = False, chunk_size = None):
+    # Number of constraints every ordering violates, as a length k array.
+    # With masks = True, also returns the (k x m) violated_masks(). Without
+    # masks, orderings are scored chunk_size rows at a time so that the
+    # intermediate arrays stay small for large populations.
+    orderings = np.atleast_2d(np.asarray(orderings))
+    if masks:
+        violated = violated_masks(orderings, constraints)
+        return violated.sum(axis = 1), violated
+    if chunk_size is None:
+        chunk_size = max(1, 2 ** 22 // max(1, len(constraints)))
+    counts = np.empty(len(orderings), dtype = np.int64)
+    for start in range(0, len(orderings), chunk_size):
+        counts[start:start + chunk_size] = violated_masks(orderings[start:start + chunk_size], constraints).sum(axis = 1)
+    return counts
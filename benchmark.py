@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import resource
+import argparse
+import platform
+import contextlib
+import subprocess
+import multiprocessing
+import solver
+import code_generator
+import output_validator
+import timing
+
+# Options passed to solver.solver_method() for every engine the benchmark
+# can run. Annealing engines use a single chain so that runs are repeatable.
+ENGINES = {
+    "sat": dict(),
+    "lazy": dict(lazy = True),
+    "maxsat": dict(use_maxsat = True),
+    "simanneal": dict(use_anneal = True, engine = "simanneal"),
+    "native": dict(use_anneal = True, engine = "native"),
+    "insertion": dict(use_anneal = True, engine = "insertion"),
+    "tempering": dict(use_anneal = True, engine = "tempering"),
+}
+
+CORPORA = {
+    "phase1": "phase1/inputs",
+    "phase2": "phase2/inputs",
+    "phase3": "phase3/inputs",
+}
+
+# Sizes (wizards, constraints) of the planted-solution instances in the
+# "generated" corpus.
+GENERATED_SIZES = [(20, 200), (50, 500), (100, 1000), (200, 2000)]
+
+def generate_instance(filename, num_wizards, num_constraints, seed):
+    # Writes a random instance that is satisfied by a hidden ordering. The same
+    # seed always gives the same file.
+    rng = random.Random(seed)
+    wizards = code_generator.generate_synthetic_names(num_wizards, rng)
+    constraints = code_generator.generate_planted_constraints(num_wizards, num_constraints, "random", rng)
+    code_generator.write_instance(filename, wizards, constraints, wizard_line = False)
+
+def convert_phase1(filename, directory):
+    # Phase1 inputs list the wizards on their second line, which the solver's
+    # input format doesn't have. Writes a copy without that line.
+    converted = os.path.join(directory, os.path.basename(filename))
+    if not os.path.isfile(converted):
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        os.makedirs(directory, exist_ok = True)
+        with open(converted, "w") as f:
+            f.write("\n".join([lines[0]] + lines[2:]) + "\n")
+    return converted
+
+def corpus_files(corpus, generated_dir, seed, limit = None):
+    if corpus == "generated":
+        os.makedirs(generated_dir, exist_ok = True)
+        files = []
+        for num_wizards, num_constraints in GENERATED_SIZES:
+            filename = os.path.join(generated_dir, "planted_{}_{}_{}.in".format(num_wizards, num_constraints, seed))
+            if not os.path.isfile(filename):
+                generate_instance(filename, num_wizards, num_constraints, seed)
+            files.append(filename)
+    else:
+        directory = CORPORA[corpus]
+        files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".in")]
+        files.sort(key = solver.natural_keys)
+        if corpus == "phase1":
+            files = [convert_phase1(f, os.path.join(generated_dir, corpus)) for f in files]
+    return files[:limit] if limit is not None else files
+
+def run_case(results, input_file, engine, seed, verbose, keep_spans):
+    # Runs in its own process, so that peak memory is measured per case and a
+    # case that runs over the time limit can be killed.
+    random.seed(seed)
+    recorder = timing.enable()
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(open(os.devnull, "w")))
+        start = time.time()
+        num_wizards, num_constraints, wizards, constraints = solver.read_input(input_file)
+        method = solver.solver_method(**ENGINES[engine])
+        solve_start = time.time()
+        solution = method(num_wizards, num_constraints, wizards, constraints, None)
+        solve_duration = time.time() - solve_start
+        with timing.span("validate"):
+            validation = output_validator.processBatch([(input_file, solution)])[0]
+    stages, counts = recorder.totals()
+    if stages.get("anneal"):
+        counts["anneal.steps_per_second"] = int(counts["anneal.steps"] / stages["anneal"])
+    results.put(dict(
+        wizards = num_wizards,
+        constraints = num_constraints,
+        violations = validation["failed"] if validation["error"] is None else num_constraints,
+        solve = solve_duration,
+        total = time.time() - start,
+        peak_memory_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        stages = stages,
+        counts = counts,
+        spans = recorder.events if keep_spans else None,
+    ))
+
+def run_benchmark(files, engines, seed, time_limit = None, verbose = False, keep_spans = False):
+    cases = []
+    for input_file in files:
+        for engine in engines:
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target = run_case, args = (results, input_file, engine, seed, verbose, keep_spans))
+            process.start()
+            case = dict(instance = input_file, engine = engine, status = "failed")
+            started = time.time()
+            while True:
+                try:
+                    case.update(results.get(timeout = 0.1))
+                    case["status"] = "ok"
+                    break
+                except queue.Empty:
+                    if not process.is_alive() and results.empty():
+                        break
+                    if time_limit is not None and time.time() - started > time_limit:
+                        case["status"] = "timed out"
+                        process.terminate()
+                        break
+            process.join()
+            print("{:<60} {:<10} {:<10} {}".format(input_file, engine, case["status"],
+                "{:.3f}s, {} violations".format(case["total"], case["violations"]) if case["status"] == "ok" else ""))
+            cases.append(case)
+    return cases
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(cases, baseline, tolerance, min_seconds):
+    # Returns the cases that got slower (by more than `tolerance` and by at
+    # least `min_seconds`), used more memory, or violate more constraints than
+    # the same (instance, engine) pair in the baseline.
+    previous = {(case["instance"], case["engine"]): case for case in baseline["cases"]}
+    regressions = []
+    for case in cases:
+        old = previous.get((case["instance"], case["engine"]))
+        if old is None or old["status"] != "ok":
+            continue
+        reasons = []
+        if case["status"] != "ok":
+            reasons.append(case["status"])
+        else:
+            if case["total"] > old["total"] * (1 + tolerance) and case["total"] - old["total"] >= min_seconds:
+                reasons.append("time {:.3f}s -> {:.3f}s".format(old["total"], case["total"]))
+            if case["peak_memory_kb"] > old["peak_memory_kb"] * (1 + tolerance):
+                reasons.append("memory {}KB -> {}KB".format(old["peak_memory_kb"], case["peak_memory_kb"]))
+            if case["violations"] > old["violations"]:
+                reasons.append("violations {} -> {}".format(old["violations"], case["violations"]))
+        if reasons:
+            regressions.append((case, reasons))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the solvers and compare the results against a saved baseline.")
+    parser.add_argument("--corpus", nargs = "+", choices = sorted(CORPORA) + ["generated"], default = ["phase1", "phase2", "generated"],
+        help="instances to run")
+    parser.add_argument("--engines", nargs = "+", choices = sorted(ENGINES), default = ["sat", "native"],
+        help="engines to run on every instance")
+    parser.add_argument("--limit", type = int, default = None,
+        help="run at most this many instances of every corpus")
+    parser.add_argument("--seed", type = int, default = 170,
+        help="seed for the generated instances and every solver run")
+    parser.add_argument("--generated-dir", default = ".benchmark",
+        help="directory the generated (and converted phase1) instances are written to")
+    parser.add_argument("--time-limit", type = float, default = 300,
+        help="seconds after which a single run is stopped")
+    parser.add_argument("--output", "-o", default = None,
+        help="write the results as JSON to this file")
+    parser.add_argument("--baseline", "-b", default = None,
+        help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type = float, default = 0.25,
+        help="relative slowdown or memory growth that counts as a regression")
+    parser.add_argument("--min-seconds", type = float, default = 0.1,
+        help="ignore slowdowns smaller than this many seconds")
+    parser.add_argument("--spans", action = "store_true",
+        help="also store every timing span of every run in the results")
+    parser.add_argument("--verbose", "-v", action = "store_true",
+        help="show the solvers' own output")
+    args = parser.parse_args()
+
+    files = []
+    for corpus in args.corpus:
+        files.extend(corpus_files(corpus, args.generated_dir, args.seed, args.limit))
+    cases = run_benchmark(files, args.engines, args.seed, args.time_limit, args.verbose, args.spans)
+    report = dict(
+        revision = git_revision(),
+        python = platform.python_version(),
+        platform = platform.platform(),
+        seed = args.seed,
+        created = time.strftime("%Y-%m-%dT%H:%M:%S"),
+        cases = cases,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+        print("Results written to {}.".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(cases, baseline, args.tolerance, args.min_seconds)
+        for case, reasons in regressions:
+            print("Regression in {} ({}): {}".format(case["instance"], case["engine"], ", ".join(reasons)))
+        print("{} regressions against {} (revision {}).".format(len(regressions), args.baseline, baseline.get("revision")))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,94 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import tempfile
+import contextlib
+
+class Checkpoint:
+    # Sidecar directory with the progress of the annealing runs for one input,
+    # so that a run that is interrupted (or killed by a batch time limit) can
+    # continue where it stopped. Every annealed instance (the whole input, or
+    # one component of it) has its own entry file, named by SolutionCache.key(),
+    # so components annealed in parallel worker processes never write to the
+    # same file. An entry holds the best ordering so far, the violations of that
+    # ordering, how many of the run's steps are done, the temperature at that
+    # step, and the state of the random module.
+    # Annealers call due() every few thousand steps and save() when it
+    # returns True. That happens at most once every `interval` seconds, and
+    # at once when SIGINT or SIGTERM arrives inside handling_signals().
+    def __init__(self, directory, interval = 30):
+        self.directory = directory
+        self.interval = interval
+        self.last_save = time.time()
+        self.key = None
+        self.run = {}
+        self.signal = None
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def resume(self, key, engine):
+        # The saved entry of an instance annealed with this engine, or None.
+        # Also puts the random module back in the state it was saved in.
+        try:
+            with open(self.path(key)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry["engine"] != engine:
+            return None
+        version, internal, gauss = entry["random"]
+        random.setstate((version, tuple(internal), gauss))
+        return entry
+
+    def start(self, key, **run):
+        # Later saves go to the entry file of this instance. The run fields
+        # (engine, steps) are stored in it along with the progress.
+        self.key = key
+        self.run = run
+
+    def due(self):
+        return self.signal is not None or time.time() - self.last_save >= self.interval
+
+    def save(self, ordering, violations, step, temperature):
+        entry = dict(self.run, ordering = list(ordering), violations = violations,
+                     step = step, temperature = temperature, random = random.getstate())
+        # Write to a temporary file first, so that a kill never leaves half a checkpoint.
+        os.makedirs(self.directory, exist_ok = True)
+        handle, temporary = tempfile.mkstemp(dir = self.directory, suffix = ".tmp")
+        with os.fdopen(handle, "w") as f:
+            json.dump(entry, f)
+        os.replace(temporary, self.path(self.key))
+        self.last_save = time.time()
+        if self.signal is not None:
+            self.stop()
+
+    def stop(self):
+        # Exit at once: a SystemExit would be caught by a ProcessPoolExecutor
+        # worker, which would then keep waiting for more work.
+        print("Stopped by signal {}, progress saved to {}.".format(self.signal, self.path(self.key)))
+        sys.stdout.flush()
+        os._exit(128 + self.signal)
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    @contextlib.contextmanager
+    def handling_signals(self):
+        # While active, SIGINT and SIGTERM only set a flag, and the annealer
+        # saves and exits at its next due() check.
+        def handler(signum, frame):
+            self.signal = signum
+        previous = {signum: signal.signal(signum, handler) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            yield self
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        # A signal that came in after the annealer's last check.
+        if self.signal is not None:
+            self.stop()
@@ -2,6 +2,8 @@ import argparse
 import random
 import math
 from instance_validator import processInput
+from instance_loader import load_instance
+from output_validator import checkOrdering
 
 BABY_NAMES = ['Emily', 'Andrew', 'Noah', 'Isaiah', 'Eliana', 'Benjamin', 'Adalyn', 'Matthew', 'Adeline', 'Caden', 'Sophia', 'Levi', 'Zoe', 'Landon', 'Mackenzie', 'Jayden', 'Arianna', 'Nicholas', 'Leah', 'Ella', 'Avery', 'Kaylee', 'Caleb', 'Christian', 'Jacob', 'Nora', 'Muhammad', 'Connor', 'Victoria', 'Sebastian', 'Aria', 'Charlotte', 'Emma', 'Ava', 'Lillian', 'Grayson', 'Julian', 'Layla', 'Brayden', 'Ellie', 'Hannah', 'Mila', 'Abigail', 'Madison', 'Camilla', 'Hailey', 'Brooklyn', 'Logan', 'Liam', 'Peyton', 'Anna', 'Elena', 'Alexander', 'Mia', 'Ryan', 'Elijah', 'Chloe', 'Aiden', 'Amelia', 'Dylan', 'Isaac', 'David', 'Henry', 'Jack', 'Cameron', 'Maria', 'Lily', 'Harper', 'Luke', 'Jayce', 'Addison', 'Evelyn', 'Wyatt', 'Grace', 'Gabriel', 'Aubrey', 'Scarlett', 'Aaliyah', 'Jackson', 'Owen', 'Eli', 'John', 'Madelyn', 'Riley', 'Daniel', 'Mason', 'Kenneth', 'Lincoln', 'Lucas', 'Oliver', 'Natalie', 'William', 'James', 'Elizabeth', 'Carter', 'Sarah', 'Isabella', 'Olivia', 'Nathan', 'Ethan', 'Orkun', 'Micah']
 
@@ -65,27 +67,135 @@ def generate_chain_constraints(wizards, num_constraints):
     print("Created random {} constraints to add on top.".format(len(other_constraints)))
     return constraints + other_constraints
 
-def write_output(filename, num_wizards, num_constraints):
-    wizards = generate_wizard_names(num_wizards)
-    # constraints = generate_constraints(wizards, num_constraints)
-    # constraints = generate_interleaved_constraints(wizards, num_constraints)
-    constraints = generate_chain_constraints(wizards, num_constraints)
-    random.shuffle(constraints)
+def generate_synthetic_names(num_wizards, rng = random):
+    # Alphanumeric names of at most 10 characters, for any number of wizards.
+    names = ["W{}".format(i) for i in range(num_wizards)]
+    rng.shuffle(names)
+    return names
+
+# The planted generators below work on positions in the hidden ordering
+# rather than names, and store every constraint as one integer
+# (a * n + b) * n + mid, so that checking for duplicates is a set lookup and
+# hundreds of thousands of constraints stay cheap to keep in memory.
+
+def sample_constraint(num_wizards, rng):
+    # A random constraint satisfied by the identity ordering: `mid` lies
+    # outside the interval between the two endpoints, the lower of which
+    # comes first.
+    n = num_wizards
+    while True:
+        lower, upper = sorted(rng.sample(range(n), 2))
+        outside = lower + (n - 1 - upper)
+        if outside > 0:
+            break
+    r = rng.randrange(outside)
+    mid = r if r < lower else upper + 1 + (r - lower)
+    return (lower * n + upper) * n + mid
+
+def swap_endpoints(constraint, num_wizards):
+    ab, mid = divmod(constraint, num_wizards)
+    a, b = divmod(ab, num_wizards)
+    return (b * num_wizards + a) * num_wizards + mid
+
+def chain_constraints(num_wizards):
+    # Triplets abc, def, ghi, ... and chains adg, ... over them, as in
+    # generate_chain_constraints(), but without wrapping around the end.
+    n = num_wizards
+    for start in range(0, n - 2, 3):
+        yield ((start * n) + start + 1) * n + start + 2
+    for start in range(0, n - 6, 9):
+        yield ((start * n) + start + 3) * n + start + 6
+
+def interleaved_constraints(num_wizards):
+    # abc, cde, efg, ...: each middle wizard is the start of the next triplet.
+    n = num_wizards
+    for start in range(0, n - 2, 2):
+        yield ((start * n) + start + 1) * n + start + 2
+
+STRUCTURES = {
+    "random": lambda num_wizards: iter(()),
+    "chain": chain_constraints,
+    "interleaved": interleaved_constraints,
+}
+
+def generate_planted_constraints(num_wizards, num_constraints, structure = "random", rng = random):
+    # Returns encoded constraints (see above) that the identity ordering
+    # satisfies: the given structure first, topped up with random constraints
+    # up to num_constraints (or as many distinct constraints as there are).
+    # Constraints are returned in random order.
+    constraints = set()
+    for constraint in STRUCTURES[structure](num_wizards):
+        if len(constraints) == num_constraints:
+            break
+        constraints.add(constraint)
+    target = min(num_constraints, get_max_constraints(num_wizards))
+    while len(constraints) < target:
+        constraints.add(sample_constraint(num_wizards, rng))
+    # Constraints are kept with their lower endpoint first while checking for
+    # duplicates, then written with the endpoints in random order.
+    constraints = [swap_endpoints(c, num_wizards) if rng.random() < 0.5 else c for c in constraints]
+    rng.shuffle(constraints)
+    return constraints
+
+def write_instance(filename, wizards, constraints, wizard_line = True, chunk_size = 10000):
+    # Streams an instance to disk: `wizards` is the planted ordering and
+    # `constraints` are encoded positions in it. Phase1 inputs list the
+    # wizards on line 2, the solver's inputs (wizard_line = False) don't.
+    n = len(wizards)
     with open(filename, "w") as f:
-        f.write(str(len(wizards)) + "\n")
-        for wizard in wizards:
-            f.write("{0} ".format(wizard))
-        f.write("\n" + str(len(constraints)) + "\n")
-        for constraint in constraints:
-            for wizard in constraint:
-                f.write("{0} ".format(wizard))
-            f.write("\n")
+        f.write("{}\n".format(n))
+        if wizard_line:
+            f.write(" ".join(wizards) + "\n")
+        f.write("{}\n".format(len(constraints)))
+        for chunk_start in range(0, len(constraints), chunk_size):
+            lines = []
+            for constraint in constraints[chunk_start:chunk_start + chunk_size]:
+                ab, mid = divmod(constraint, n)
+                a, b = divmod(ab, n)
+                lines.append("{} {} {}\n".format(wizards[a], wizards[b], wizards[mid]))
+            f.writelines(lines)
+
+def write_output(filename, num_wizards, num_constraints, structure = "chain", wizard_line = True, synthetic = False, rng = random):
+    if synthetic or num_wizards > len(BABY_NAMES):
+        wizards = generate_synthetic_names(num_wizards, rng)
+    else:
+        wizards = rng.sample(BABY_NAMES, num_wizards)
+    constraints = generate_planted_constraints(num_wizards, num_constraints, structure, rng)
+    write_instance(filename, wizards, constraints, wizard_line)
+    return wizards, len(constraints)
+
+def check_planted(filename, wizards, num_constraints, wizard_line):
+    # Phase1 inputs go through the instance validator (with its size limits
+    # raised to this instance); solver inputs are checked against the planted
+    # ordering with the output validator.
+    if wizard_line:
+        return processInput(filename, len(wizards), num_constraints)
+    violated = checkOrdering(load_instance(filename), wizards)
+    if isinstance(violated, str):
+        return violated
+    if violated.any():
+        return "The planted ordering violates {} constraints.".format(int(violated.sum()))
+    return "Success!"
 
 if __name__=="__main__":
     parser = argparse.ArgumentParser(description = "Constraint Solver.")
     parser.add_argument("num_wizards", type=int, help = "___.in")
     parser.add_argument("num_constraints", type=int, help = "___.out")
     parser.add_argument("output_file", type=str, help = "___.out")
+    parser.add_argument("--structure", choices = sorted(STRUCTURES), default = "chain",
+        help = "constraints to plant before topping up with random ones")
+    parser.add_argument("--solver-format", dest = "wizard_line", action = "store_false",
+        help = "leave out the wizard list on line 2, as in the solver's inputs")
+    parser.add_argument("--synthetic", action = "store_true",
+        help = "use generated names instead of baby names (always done above {} wizards)".format(len(BABY_NAMES)))
+    parser.add_argument("--solution", type=str, default = None,
+        help = "also write the planted ordering to this file")
+    parser.add_argument("--seed", type=int, default = None,
+        help = "seed for a reproducible instance")
     args = parser.parse_args()
-    write_output(args.output_file, args.num_wizards, args.num_constraints)
-    print("Checking if generated file is valid: " + processInput(args.output_file, args.num_wizards))
\ No newline at end of file
+    rng = random.Random(args.seed)
+    wizards, num_constraints = write_output(args.output_file, args.num_wizards, args.num_constraints, args.structure, args.wizard_line, args.synthetic, rng)
+    if args.solution:
+        with open(args.solution, "w") as f:
+            f.write(" ".join(wizards))
+    print("Checking if generated file is valid: " + check_planted(args.output_file, wizards, num_constraints, args.wizard_line))
@@ -0,0 +1,70 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+class Instance:
+    # A parsed input file. Wizard names are interned to dense integer ids in
+    # order of first appearance: names[i] is the name of wizard i, and every
+    # row of the (m x 3) int32 array `constraints` is (a, b, middle).
+    def __init__(self, num_wizards, names, constraints):
+        self.num_wizards = num_wizards
+        self.names = names
+        self.constraints = constraints
+
+    @property
+    def num_constraints(self):
+        return len(self.constraints)
+
+    def constraint_names(self):
+        names = self.names
+        return [[names[a], names[b], names[mid]] for a, b, mid in self.constraints.tolist()]
+
+def parse_instance(filename):
+    # Read the whole file in one go: the number of wizards, the number of
+    # constraints and then three wizard names per constraint.
+    with open(filename) as f:
+        tokens = f.read().split()
+    num_wizards = int(tokens[0])
+    num_constraints = int(tokens[1])
+    words = tokens[2:2 + 3 * num_constraints]
+    if len(words) != 3 * num_constraints:
+        raise ValueError("{} promises {} constraints but only has {} wizard names.".format(filename, num_constraints, len(words)))
+    index = {}
+    ids = [index.setdefault(word, len(index)) for word in words]
+    constraints = np.array(ids, dtype = np.int32).reshape(num_constraints, 3)
+    return Instance(num_wizards, list(index), constraints)
+
+def cache_paths(filename, cache_dir):
+    # Cache files are tied to the input's path, size and modification time,
+    # so editing an input invalidates its cached copy.
+    stat = os.stat(filename)
+    identity = "{}:{}:{}".format(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    stem = "{}-{}".format(os.path.basename(filename), hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16])
+    return os.path.join(cache_dir, stem + ".npy"), os.path.join(cache_dir, stem + ".names")
+
+def load_instance(filename, cache_dir = None):
+    # Parse an input file, or, with a cache_dir, memory-map the binary copy
+    # written by an earlier call instead of parsing the text again.
+    if cache_dir is None:
+        return parse_instance(filename)
+    constraints_path, names_path = cache_paths(filename, cache_dir)
+    if os.path.isfile(constraints_path) and os.path.isfile(names_path):
+        with open(names_path) as f:
+            lines = f.read().split("\n")
+        constraints = np.load(constraints_path, mmap_mode = "r")
+        return Instance(int(lines[0]), lines[1:], constraints)
+    instance = parse_instance(filename)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to temporary files first so parallel workers never load half a
+    # copy. The names file goes last: readers only use a copy once it exists.
+    handle, temporary = tempfile.mkstemp(dir = cache_dir, suffix = ".tmp")
+    with os.fdopen(handle, "wb") as f:
+        np.save(f, instance.constraints)
+    os.replace(temporary, constraints_path)
+    handle, temporary = tempfile.mkstemp(dir = cache_dir, suffix = ".tmp")
+    with os.fdopen(handle, "w") as f:
+        f.write("\n".join([str(instance.num_wizards)] + instance.names))
+    os.replace(temporary, names_path)
+    return instance
@@ -3,15 +3,19 @@
 import sys
 
 def main(argv):
-    if len(argv) != 2:
-        print("Usage: python instance_validator.py [path_to_input_file] [20, 35 or 50]")
+    if len(argv) not in [2, 3]:
+        print("Usage: python instance_validator.py [path_to_input_file] [20, 35 or 50] [max_constraints (default 500)]")
         return
-    if (int(argv[1]) not in [20, 35, 50]):
+    if (int(argv[1]) not in [20, 35, 50]) and len(argv) == 2:
         print("The final argument must be 20, 35 or 50.")
-    print(processInput(argv[0], int(argv[1])))
+    max_constraints = int(argv[2]) if len(argv) == 3 else 500
+    print(processInput(argv[0], int(argv[1]), max_constraints))
 
-def processInput(s, max_nodes):
-    fin = open(s, "r")
+def processInput(s, max_nodes, max_constraints = 500):
+    with open(s, "r") as fin:
+        return checkInput(fin, max_nodes, max_constraints)
+
+def checkInput(fin, max_nodes, max_constraints):
     line1 = fin.readline().split()
     # Ensures that the first line contains an integer.
     if len(line1) != 1 or not line1[0].isdigit():
@@ -46,8 +50,8 @@ def processInput(s, max_nodes):
         return "Line 3 must contain a single integer, which is the total number of age constraints you've heard at the party."
 
     num_constraints = int(line3[0])
-    if (num_constraints < 1 or num_constraints > 500):
-        return "You must have heard between 1 and 500 (inclusive) age constraints at the party."
+    if (num_constraints < 1 or num_constraints > max_constraints):
+        return "You must have heard between 1 and {max_constraints} (inclusive) age constraints at the party.".format(max_constraints=max_constraints)
 
     # Makes sure that all the constraints match up with the provided perfect ordering.
     for i in range(num_constraints):
@@ -1,56 +1,108 @@
 # Released to students
 
+import os
 import sys
+import numpy as np
+from instance_loader import load_instance
+from batch_energy import violated_masks
 
 def main(argv):
     if len(argv) != 2:
         print("Usage: python output_validator.py [path_to_input_file] [path_to_output_file]")
+        print("       python output_validator.py [path_to_input_folder] [path_to_output_folder]")
+        return
+    if os.path.isdir(argv[0]):
+        printReport(processDirectories(argv[0], argv[1]))
         return
     constraints_satisfied, num_constraints, constraints_failed = processInput(argv[0], argv[1])
     print("You satisfied {}/{} constraints. List of failed constraints: {}".format(constraints_satisfied, num_constraints, constraints_failed))
 
-def processInput(input_file, output_file):
-    fin = open(input_file, "r")
-    fout = open(output_file, "r")
-
-    num_wiz_in_input = int(fin.readline().split()[0])
-    #input_wizard_set = set(fin.readline().split())
-    num_constraints = int(fin.readline().split()[0])
-
-    output_ordering = fout.readline().split()
-    output_ordering_set = set(output_ordering)
+def checkOrdering(instance, output_ordering):
+    # Checks every constraint of a loaded instance at once. Returns a boolean
+    # array with one entry per constraint (True if violated), or a string
+    # describing why the ordering is not valid at all.
     output_ordering_map = {k: v for v, k in enumerate(output_ordering)}
 
+    if (len(output_ordering_map) != instance.num_wizards):
+        return "Input file has unique {} wizards, but output file has {}".format(instance.num_wizards, len(output_ordering_map))
 
-    if (len(output_ordering_set) != num_wiz_in_input):
-        return "Input file has unique {} wizards, but output file has {}".format(num_wiz_in_input, len(output_ordering_set))
-
-    if (len(output_ordering_set) != len(output_ordering)):
+    if (len(output_ordering_map) != len(output_ordering)):
         return "The output ordering contains repeated wizards."
 
-    # if (input_wizard_set != output_ordering_set):
-    #     return "The output ordering contains wizards that are different from the ones in the input ordering."
+    instance_ids = {k: v for v, k in enumerate(instance.names)}
+    missing = [wizard for wizard in instance.names if wizard not in output_ordering_map]
+    if missing:
+        return "The output ordering is missing wizards from the input: {}".format(missing)
 
-    # Counts how many constraints are satisfied.
-    constraints_satisfied = 0
-    constraints_failed = []
-    for i in range(num_constraints):
-        line_num = i + 4
-        constraint = fin.readline().split()
+    # Wizards the input declares but no constraint names get the remaining ids.
+    ordering = np.array([instance_ids.setdefault(wizard, len(instance_ids)) for wizard in output_ordering], dtype = np.int32)
+    return violated_masks(ordering, instance.constraints)[0]
 
-        c = constraint # Creating an alias for easy reference
-        m = output_ordering_map # Creating an alias for easy reference
+def readOrdering(output_file):
+    with open(output_file, "r") as fout:
+        return fout.readline().split()
 
-        wiz_a = m[c[0]]
-        wiz_b = m[c[1]]
-        wiz_mid = m[c[2]]
+def processInput(input_file, output_file):
+    instance = load_instance(input_file)
+    violated = checkOrdering(instance, readOrdering(output_file))
+    if isinstance(violated, str):
+        return violated
 
-        if (wiz_a < wiz_mid < wiz_b) or (wiz_b < wiz_mid < wiz_a):
-            constraints_failed.append(c)
+    num_constraints = instance.num_constraints
+    names = instance.names
+    constraints_failed = [[names[a], names[b], names[mid]] for a, b, mid in instance.constraints[violated].tolist()]
+    constraints_satisfied = num_constraints - len(constraints_failed)
+    return constraints_satisfied, num_constraints, constraints_failed
+
+def processBatch(pairs, cache_dir = None):
+    # Validates (input_file, output) pairs, where output is either the path of
+    # an output file or an ordering (list of wizard names) held in memory.
+    # Returns one dict per pair with the number of satisfied and failed
+    # constraints, or the reason the pair could not be validated.
+    results = []
+    for input_file, output in pairs:
+        result = {"input": input_file, "output": output if isinstance(output, str) else None,
+                  "satisfied": 0, "failed": 0, "total": 0, "error": None}
+        try:
+            instance = load_instance(input_file, cache_dir)
+            ordering = readOrdering(output) if isinstance(output, str) else output
+            violated = checkOrdering(instance, ordering)
+        except (IOError, OSError, ValueError, IndexError) as e:
+            violated = str(e)
+        if isinstance(violated, str):
+            result["error"] = violated
         else:
-            constraints_satisfied += 1
+            result["total"] = instance.num_constraints
+            result["failed"] = int(np.count_nonzero(violated))
+            result["satisfied"] = result["total"] - result["failed"]
+        results.append(result)
+    return results
 
-    return constraints_satisfied, num_constraints, constraints_failed
+def outputFileFor(input_file, output_dir):
+    # Outputs are named like the inputs, with .in replaced by .out and, outside
+    # of phase3, "input" replaced by "output".
+    file_name = os.path.split(input_file)[1].replace(".in", ".out")
+    renamed = os.path.join(output_dir, file_name.replace("input", "output"))
+    if os.path.isfile(renamed):
+        return renamed
+    return os.path.join(output_dir, file_name)
+
+def processDirectories(input_dir, output_dir, cache_dir = None):
+    inputs = sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(".in"))
+    return processBatch([(input_file, outputFileFor(input_file, output_dir)) for input_file in inputs], cache_dir)
+
+def printReport(results):
+    valid = [result for result in results if result["error"] is None]
+    solved = [result for result in valid if result["failed"] == 0]
+    for result in results:
+        if result["error"] is not None:
+            print("{}: {}".format(result["input"], result["error"]))
+        elif result["failed"] > 0:
+            print("{}: failed {}/{} constraints.".format(result["input"], result["failed"], result["total"]))
+    print("{} files: {} fully satisfied, {} with failed constraints, {} could not be validated.".format(
+        len(results), len(solved), len(valid) - len(solved), len(results) - len(valid)))
+    print("Satisfied {}/{} constraints in total.".format(
+        sum(result["satisfied"] for result in valid), sum(result["total"] for result in valid)))
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import tempfile
+
+class SolutionCache:
+    # On-disk cache of solved instances, one JSON file per instance, keyed by
+    # a hash of the instance's canonical form. Stores the best ordering found,
+    # how many constraints it violates and how long solving took. Once there
+    # are more than max_entries files, the least recently used are evicted.
+    def __init__(self, directory, max_entries = 10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(wizards, constraints):
+        # "middle not between a and b" is the same as "middle not between b
+        # and a", so the endpoints are sorted and duplicates dropped.
+        canonical = set()
+        for constraint in constraints:
+            a, b, mid = [wizard.strip() for wizard in constraint]
+            canonical.add((min(a, b), max(a, b), mid))
+        instance = "\n".join(sorted(wizard.strip() for wizard in wizards))
+        instance += "\n\n" + "\n".join(" ".join(constraint) for constraint in sorted(canonical))
+        return hashlib.sha256(instance.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, wizards, constraints):
+        path = self.path(self.key(wizards, constraints))
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark the entry as recently used.
+        os.utime(path, None)
+        return entry
+
+    def put(self, wizards, constraints, ordering, violations, solve_time):
+        # Keep the entry only if it improves on what is cached already.
+        cached = self.get(wizards, constraints)
+        if cached is not None and cached["violations"] <= violations:
+            return
+        entry = {"ordering": list(ordering), "violations": violations, "solve_time": round(solve_time, 3)}
+        # Write to a temporary file first so parallel workers never see half an entry.
+        handle, temporary = tempfile.mkstemp(dir = self.directory, suffix = ".tmp")
+        with os.fdopen(handle, "w") as f:
+            json.dump(entry, f)
+        os.replace(temporary, self.path(self.key(wizards, constraints)))
+        self.evict()
+
+    def discard(self, wizards, constraints):
+        # Drop an entry that turned out to be wrong, so that put() replaces it.
+        try:
+            os.remove(self.path(self.key(wizards, constraints)))
+        except OSError:
+            pass
+
+    def evict(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key = lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
@@ -3,62 +3,62 @@ import re
 import sys
 import time
 import math
+import queue
+import copy
 import random
+import signal
+import array
+import bisect
 import pycosat
 import argparse
+import contextlib
+import functools
 import itertools
+import threading
+import multiprocessing
+import concurrent.futures
 import simanneal
+import batch_energy
 import output_validator
+import timing
+import telemetry
+from checkpoint import Checkpoint
+from solution_cache import SolutionCache
+from instance_loader import load_instance
 
 DEBUG = False
+# solve_lazily() gives up on cycle cuts after this many rounds, or once its
+# cuts cover this share of all triples of wizards, and adds the full
+# transitivity encoding instead.
+LAZY_MAX_ROUNDS = 10
+LAZY_MAX_TRIPLE_SHARE = 0.05
+# Components with fewer wizards than this are solved in the calling process by
+# solve_decomposed(), not in its worker pool.
+DECOMPOSE_INLINE_SIZE = 10
 PHASE3_ASSIGNMENTS = "submission_4718752_inputs_input20.in,submission_4714724_input20.in,submission_4704348_input20.in,submission_4710132_inputs_input35.in,submission_4699130_input20.in,submission_4714897_input35.in,submission_4614378_inputs_input20.in,submission_4650900_input35.in,submission_4717644_input20.in,submission_4715459_inputs_input20.in,submission_4699033_input35.in,submission_4712182_inputs_input35.in,submission_4716271_input50.in,submission_4718264_inputs_input20.in,submission_4706128_input35.in,submission_4718771_inputs_input20.in,submission_4718317_inputs_input35.in,submission_4694872_inputs_input20.in,submission_4700810_input50.in,submission_4710107_input50.in,submission_4711880_input50.in,submission_4620699_input35.in,submission_4694872_inputs_input50.in,submission_4718439_input50.in,submission_4620699_input50.in,submission_4718690_inputs_input50.in,submission_4709616_inputs_input35.in,submission_4694224_input20.in,submission_4718317_inputs_input50.in,submission_4718113_inputs_input20.in,submission_4614378_inputs_input50.in,submission_4716635_inputs_input35.in,submission_4716992_input50.in,submission_4681981_input50.in,submission_4708792_inputs_input50.in,submission_4712937_inputs_input20.in,submission_4713735_inputs_input35.in,submission_4715936_inputs_input50.in,submission_4702980_input35.in,submission_4718037_inputs_input35.in,submission_4660979_inputs_input20.in,submission_4714821_input50.in,submission_4714364_input50.in,submission_4716827_inputs_input50.in,submission_4702546_inputs_input35.in,submission_4714637_input20.in,submission_4712193_input35.in,submission_4718733_input50.in,submission_4696578_input20.in"
 
-class Variable:
-    def __init__(self, wizard1, wizard2):
-        self.wizard1 = min(wizard1, wizard2)
-        self.wizard2 = max(wizard1, wizard2)
-    
-    def __eq__(self, other):
-        return self.wizard1 == other.wizard1 and self.wizard2 == other.wizard2
+class VariableList:
+    # One variable per unordered pair of wizards i < j (wizards are encoded as
+    # integers 0..n-1). The variable is TRUE iff wizard i comes BEFORE wizard j.
+    # Variable ids are computed arithmetically rather than looked up.
+    def __init__(self, num_wizards):
+        self.num_wizards = num_wizards
 
-    def __hash__(self):
-        return hash(self.wizard1 + self.wizard2)
-    
-    def __repr__(self):
-        return "Variable: {} BEFORE {}".format(self.wizard1, self.wizard2)
+    def encode_variable(self, i, j):
+        # Pairs are numbered row by row: (0, 1), (0, 2), ..., (0, n-1), (1, 2), ...
+        return i * (2 * self.num_wizards - i - 1) // 2 + (j - i - 1) + 1
 
-class VariableList:
-    def __init__(self, wizards):
-        combinations = list((itertools.combinations(wizards, 2)))
-        variables = [Variable(wizard1, wizard2) for wizard1, wizard2 in combinations]
-        self.encoder = {}
-        for i in range(len(variables)):
-            self.encoder[variables[i]] = i + 1
-        
-    def encode_variable(self, variable):
-        return self.encoder[variable]
-    
-    def __len__(self):
-        return len(self.encoder)
+    def before(self, i, j):
+        # Literal that is TRUE iff wizard i comes before wizard j.
+        if i < j:
+            return self.encode_variable(i, j)
+        return -self.encode_variable(j, i)
 
-    def __repr__(self):
-        result = "Variable List <size: {}>".format(len(self.encoder))
-        for variable in self.encoder:
-            result += "\n{} -> {}".format(self.encoder[variable], str(variable))
-        return result
+    def __len__(self):
+        return self.num_wizards * (self.num_wizards - 1) // 2
 
-class Literal:
-    def __init__(self, variable, value):
-        self.variable = variable
-        self.value = value
-    
-    def to_pycosat(self, variable_list):
-        multiplier = 1 if self.value else -1
-        return variable_list.encode_variable(self.variable) * multiplier
-    
     def __repr__(self):
-        assigned = "TRUE" if self.value else "FALSE"
-        return "Literal: <{}> set to {}".format(str(self.variable), assigned)
+        return "Variable List <size: {}>".format(len(self))
 
 class Constraint:
     def __init__(self, triplet):
@@ -66,133 +66,1311 @@ class Constraint:
         self.bound1 = triplet[0]
         self.bound2 = triplet[1]
         self.middle = triplet[2]
-    
+
     # For each constraint "middle not between bound1 and bound2"
     # return a caluse of the form:
-    # (bound1 < middle OR bound2 > middle) AND (bound2 < middle OR bound1 > middle).
+    # (bound1 < middle OR middle < bound2) AND (bound2 < middle OR middle < bound1).
     def to_clause(self, variable_list):
-        a1 = Literal(Variable(self.bound1, self.middle), self.bound1 < self.middle)
-        a2 = Literal(Variable(self.bound2, self.middle), self.bound2 > self.middle)
-        b1 = Literal(Variable(self.bound2, self.middle), self.bound2 < self.middle)
-        b2 = Literal(Variable(self.bound1, self.middle), self.bound1 > self.middle)
-        return [Clause([a1, a2]), Clause([b1, b2])]
-
-class Clause(object):
-    def __init__(self, literals):
-        self.literals = literals
-    
-    def to_pycosat(self, variable_list):
-        return [literal.to_pycosat(variable_list) for literal in self.literals]
+        before = variable_list.before
+        return [
+            [before(self.bound1, self.middle), before(self.middle, self.bound2)],
+            [before(self.bound2, self.middle), before(self.middle, self.bound1)],
+        ]
 
-    def __repr__(self):
-        return "Clause:" + " OR ".join([str(literal) for literal in self.literals])
+def transitivity_clauses(variable_list):
+    # For every triple i < j < k forbid the two cyclic orderings
+    # i < j < k < i and i > j > k > i.
+    encode = variable_list.encode_variable
+    n = variable_list.num_wizards
+    for i in range(n):
+        for j in range(i + 1, n):
+            ij = encode(i, j)
+            ik = encode(i, j + 1) - 1
+            jk = encode(j, j + 1) - 1
+            for k in range(j + 1, n):
+                ik += 1
+                jk += 1
+                yield [-ij, ik, -jk]
+                yield [ij, -ik, jk]
+
+def transitivity_clause_pair(variable_list, i, j, k):
+    # The two anti-cycle clauses of transitivity_clauses for one triple i < j < k.
+    ij = variable_list.encode_variable(i, j)
+    ik = variable_list.encode_variable(i, k)
+    jk = variable_list.encode_variable(j, k)
+    return [[-ij, ik, -jk], [ij, -ik, jk]]
+
+def find_cycles(num_wizards, edges):
+    # Depth-first search over the "i before j" edges. Returns a topological
+    # order of the wizards if the edges are acyclic, otherwise the cycles
+    # closed by the back edges that the search ran into.
+    successors = [[] for _ in range(num_wizards)]
+    for i, j in edges:
+        successors[i].append(j)
+    state = [0] * num_wizards # 0: unvisited, 1: on the stack, 2: done
+    postorder = []
+    cycles = []
+    for root in range(num_wizards):
+        if state[root]:
+            continue
+        path = [root]
+        iterators = [iter(successors[root])]
+        index = {root: 0}
+        state[root] = 1
+        while path:
+            for j in iterators[-1]:
+                if state[j] == 0:
+                    index[j] = len(path)
+                    path.append(j)
+                    iterators.append(iter(successors[j]))
+                    state[j] = 1
+                    break
+                if state[j] == 1:
+                    cycles.append(path[index[j]:])
+            else:
+                i = path.pop()
+                iterators.pop()
+                del index[i]
+                state[i] = 2
+                postorder.append(i)
+    return list(reversed(postorder)), cycles
+
+def count_violations(ordering, constraints):
+    # Number of (integer encoded) constraints that an ordering of wizards violates.
+    if not constraints:
+        return 0
+    return int(batch_energy.violation_counts(ordering, batch_energy.constraint_array(constraints))[0])
+
+def at_most_clauses(literals, bound, next_variable):
+    # Sequential counter encoding of "at most `bound` of `literals` are TRUE".
+    # Auxiliary variable s(i, j) (TRUE if at least j of the first i + 1 literals
+    # are TRUE) is numbered from next_variable on.
+    if bound == 0:
+        return [[-x] for x in literals]
+    m = len(literals)
+    s = lambda i, j: next_variable + i * bound + (j - 1)
+    clauses = [[-literals[0], s(0, 1)]]
+    clauses.extend([-s(0, j)] for j in range(2, bound + 1))
+    for i in range(1, m - 1):
+        x = literals[i]
+        clauses.append([-x, s(i, 1)])
+        clauses.append([-s(i - 1, 1), s(i, 1)])
+        for j in range(2, bound + 1):
+            clauses.append([-x, -s(i - 1, j - 1), s(i, j)])
+            clauses.append([-s(i - 1, j), s(i, j)])
+        clauses.append([-x, -s(i - 1, bound)])
+    if m > 1:
+        clauses.append([-literals[m - 1], -s(m - 2, bound)])
+    return clauses
+
+def encode_constraints(wizards, constraints):
+    # Map wizard names to integers and drop constraints that repeat a wizard.
+    encoder = {k: v for v, k in enumerate(wizards)}
+    encoded = []
+    for c in constraints:
+        if len(set(c)) == len(c):
+            encoded.append((encoder[c[0]], encoder[c[1]], encoder[c[2]]))
+    return encoded
+
+def canonical_constraints(constraints):
+    # "middle not between a and b" is the same constraint as "middle not
+    # between b and a": order the endpoints and drop duplicates.
+    canonical = set()
+    for a, b, mid in constraints:
+        canonical.add((min(a, b), max(a, b), mid))
+    return sorted(canonical)
+
+def remove_subsumed(clauses, units):
+    # Drop duplicate clauses and clauses that contain one of the unit literals.
+    # Returns the remaining clauses and how many were dropped.
+    seen = set()
+    simplified = []
+    for clause in clauses:
+        key = tuple(sorted(clause))
+        if key in seen or any(unit in clause for unit in units):
+            continue
+        seen.add(key)
+        simplified.append(clause)
+    return simplified, len(clauses) - len(simplified)
+
+class Substitution:
+    # Result of simplify_binary_clauses(): variables whose value is fixed and
+    # variables that are equivalent to a literal of another variable.
+    def __init__(self, fixed, equivalent):
+        self.fixed = fixed
+        self.equivalent = equivalent
+        self.replaced = set(fixed) | set(equivalent)
+
+    def apply(self, clause):
+        # Rewrite a clause over the remaining variables. Returns None if the
+        # clause is satisfied and [] if it can no longer be satisfied.
+        replaced = self.replaced
+        if not any(abs(literal) in replaced for literal in clause):
+            return clause
+        result = []
+        for literal in clause:
+            variable = abs(literal)
+            if variable in self.fixed:
+                if self.fixed[variable] == (literal > 0):
+                    return None
+                continue
+            if variable in self.equivalent:
+                literal = self.equivalent[variable] if literal > 0 else -self.equivalent[variable]
+            if -literal in result:
+                return None
+            if literal not in result:
+                result.append(literal)
+        return result
 
-def solve(num_wizards, num_constraints, wizards, constraints, data = None):
+    def apply_all(self, clauses):
+        for clause in clauses:
+            clause = self.apply(clause)
+            if clause is not None:
+                yield clause
+
+    def expand(self, pycosat_output, num_variables):
+        # Turn a model of the rewritten clauses into one of the original clauses.
+        values = [False] * (num_variables + 1)
+        for literal in pycosat_output:
+            if abs(literal) <= num_variables:
+                values[abs(literal)] = literal > 0
+        for variable, value in self.fixed.items():
+            values[variable] = value
+        for variable, literal in self.equivalent.items():
+            values[variable] = values[abs(literal)] == (literal > 0)
+        return [variable if values[variable] else -variable for variable in range(1, num_variables + 1)]
+
+def simplify_binary_clauses(clauses):
+    # Build the implication graph of the unit and binary clauses (a OR b gives
+    # NOT a -> b and NOT b -> a) and find its strongly connected components.
+    # Literals in one component are equivalent, and a literal that implies its
+    # own negation is FALSE. Returns a Substitution, or None if some literal is
+    # equivalent to its negation (the clauses are unsatisfiable).
+    successors = {}
+    for clause in clauses:
+        if len(clause) == 1:
+            clause = clause * 2
+        elif len(clause) != 2:
+            continue
+        a, b = clause
+        for literal in (a, -a, b, -b):
+            successors.setdefault(literal, [])
+        successors[-a].append(b)
+        successors[-b].append(a)
+
+    # Tarjan's algorithm, iteratively. Components come out sinks first.
+    index, lowlink, component = {}, {}, {}
+    components = []
+    stack, on_stack = [], set()
+    for root in successors:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors[root]))]
+        while work:
+            literal, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors[child])))
+                    break
+                if child in on_stack:
+                    lowlink[literal] = min(lowlink[literal], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[literal])
+                if lowlink[literal] == index[literal]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component[member] = len(components)
+                        members.append(member)
+                        if member == literal:
+                            break
+                    components.append(members)
+
+    # reach[c] is a bitmask of the components reachable from component c.
+    reach = []
+    for c, members in enumerate(components):
+        mask = 1 << c
+        for member in members:
+            for child in successors[member]:
+                if component[child] != c:
+                    mask |= reach[component[child]]
+        reach.append(mask)
+
+    fixed, equivalent = {}, {}
+    for c, members in enumerate(components):
+        if any(component[-member] == c for member in members):
+            return None
+        if reach[c] >> component[-members[0]] & 1:
+            for member in members:
+                fixed[abs(member)] = member < 0
+    for c, members in enumerate(components):
+        if len(members) > 1 and abs(members[0]) not in fixed:
+            representative = min(members, key = abs)
+            for member in members:
+                if abs(member) != abs(representative):
+                    equivalent[abs(member)] = representative if member > 0 else -representative
+    return Substitution(fixed, equivalent)
+
+def decode_ordering(variable_list, pycosat_output):
+    # The model is acyclic, so "before" is a total order on the wizards.
+    # Any variables past the pair variables (e.g. MaxSAT relaxations) are ignored.
+    assignments = [False] * (len(variable_list) + 1)
+    for assignment in pycosat_output:
+        if abs(assignment) <= len(variable_list):
+            assignments[abs(assignment)] = assignment > 0
+    def compare(i, j):
+        if i == j:
+            return 0
+        literal = variable_list.before(i, j)
+        return -1 if assignments[abs(literal)] == (literal > 0) else 1
+    return sorted(range(variable_list.num_wizards), key = functools.cmp_to_key(compare))
+
+def solve_lazily(variables, clauses, constraints, substitution):
+    # Only the pairs that appear in constraint clauses decide whether the
+    # constraints hold, so start with no 3-Term clauses at all and look at the
+    # graph of "i before j" edges the assignment gives those pairs. If it is
+    # acyclic, a topological order of it satisfies every constraint. Otherwise
+    # forbid each cycle i1 -> i2 -> ... -> ik -> i1 with the 3-Term clauses of
+    # the triples (i1, i2, i3), (i1, i3, i4), ..., (i1, ik-1, ik) and solve
+    # again. Together those clauses rule the cycle out through the pairs
+    # (i1, i3), ..., (i1, ik-1), which never need to enter the graph.
+    # Every round solves from scratch, so when the cuts don't converge
+    # quickly the eager encoding is cheaper: see LAZY_MAX_ROUNDS.
+    clauses = list(clauses)
+    pairs = set()
+    for a, b, mid in constraints:
+        pairs.add((min(a, mid), max(a, mid)))
+        pairs.add((min(b, mid), max(b, mid)))
+    triples = set()
+    max_triples = LAZY_MAX_TRIPLE_SHARE * variables.num_wizards * (variables.num_wizards - 1) * (variables.num_wizards - 2) / 6
+    iterations = 0
+    while True:
+        iterations += 1
+        if iterations > LAZY_MAX_ROUNDS or len(triples) > max_triples:
+            print("Lazy transitivity gave up after {} iterations and {} 3-Term clause pairs, adding all of them.".format(iterations - 1, len(triples)))
+            cnf = itertools.chain(clauses, substitution.apply_all(transitivity_clauses(variables)))
+            pycosat_output = pycosat.solve(cnf, vars = len(variables))
+            if pycosat_output == "UNSAT":
+                return None
+            return decode_ordering(variables, substitution.expand(pycosat_output, len(variables)))
+        pycosat_output = pycosat.solve(clauses, vars = len(variables))
+        if pycosat_output == "UNSAT":
+            return None
+        assignments = [False] * (len(variables) + 1)
+        for assignment in substitution.expand(pycosat_output, len(variables)):
+            assignments[abs(assignment)] = assignment > 0
+        edges = [(i, j) if assignments[variables.encode_variable(i, j)] else (j, i) for i, j in pairs]
+        ordering, cycles = find_cycles(variables.num_wizards, edges)
+        if DEBUG:
+            print("Iteration {}: {} clauses, {} cycles.".format(iterations, len(clauses), len(cycles)))
+        if not cycles:
+            break
+        for cycle in cycles:
+            for k in range(1, len(cycle) - 1):
+                triple = tuple(sorted((cycle[0], cycle[k], cycle[k + 1])))
+                if triple not in triples:
+                    triples.add(triple)
+                    clauses.extend(substitution.apply_all(transitivity_clause_pair(variables, *triple)))
+    print("Lazy transitivity took {} iterations and {} 3-Term clause pairs.".format(iterations, len(triples)))
+    return ordering
+
+def remaining_time(deadline, start):
+    # What is left of a deadline (in seconds, or None) counted from start.
+    return None if deadline is None else max(0, deadline - (time.time() - start))
+
+def solve(num_wizards, num_constraints, wizards, constraints, data = None, lazy = False, deadline = None, report = None):
+    # If the constraints can't all be satisfied, falls back to maxsat(), which
+    # gets the rest of the deadline (in seconds) and the report callback.
     # Pre-processing.
     processing_start = time.time()
     if DEBUG:
         print("Input with {} wizards and {} constraints.".format(len(wizards), len(constraints)))
     random.shuffle(wizards)
-    constraints = [constraint for constraint in constraints if len(constraint) == len(set(constraint))]
+    with timing.span("encode_constraints") as fields:
+        encoded_constraints = encode_constraints(wizards, constraints)
+        num_encoded = len(encoded_constraints)
+        encoded_constraints = canonical_constraints(encoded_constraints)
+        fields["constraints"] = len(encoded_constraints)
 
-    # Generate all possible variables of 2 wizards each.
-    variables = VariableList(wizards)
-    assert(len(variables) == len(wizards) * (len(wizards) - 1) / 2)
+    # One variable for every pair of wizards.
+    with timing.span("variable_list") as fields:
+        variables = VariableList(len(wizards))
+        fields["variables"] = len(variables)
     if DEBUG:
         print(variables)
 
     # Convert constraints to SAT clauses.
-    clauses = []
-    for triplet in constraints:
-        constraint = Constraint(triplet)
-        clause_pair = constraint.to_clause(variables)
-        clauses.extend(clause_pair)
-    assert(len(clauses) == len(constraints) * 2)
-
-    # Add 3-Term clauses to prevent loops.
-    sorted_wizards = sorted(wizards)
-    for i in range(len(sorted_wizards)):
-        for j in range(i + 1, len(sorted_wizards)):
-            for k in range(j + 1, len(sorted_wizards)):
-                w1, w2, w3 = sorted_wizards[i], sorted_wizards[j], sorted_wizards[k]
-                a1 = Literal(Variable(w1, w2), False)
-                a2 = Literal(Variable(w1, w3), True)
-                a3 = Literal(Variable(w2, w3), False)
-                clauses.append(Clause([a1, a2, a3]))
-                b1 = Literal(Variable(w1, w2), True)
-                b2 = Literal(Variable(w1, w3), False)
-                b3 = Literal(Variable(w2, w3), True)
-                clauses.append(Clause([b1, b2, b3]))
-    assert(len(clauses) == len(constraints) * 2 + len(list(itertools.combinations(range(len(wizards)), 3))) * 2)
+    with timing.span("constraint_clauses") as fields:
+        clauses = []
+        for triplet in encoded_constraints:
+            clauses.extend(Constraint(triplet).to_clause(variables))
+        assert(len(clauses) == len(encoded_constraints) * 2)
+
+        # The reverse of a valid ordering is valid too, so fix the first two
+        # wizards' relative order to halve the search space. That unit subsumes
+        # one 3-Term clause of every triple (0, 1, k), which the 2-SAT
+        # simplification below takes care of.
+        units = [variables.before(0, 1)] if len(wizards) > 1 else []
+        clauses, num_subsumed = remove_subsumed(clauses, units)
+        clauses = [[unit] for unit in units] + clauses
+        fields["clauses"] = len(clauses)
+    print("Preprocessing removed {} duplicate constraints and {} subsumed clauses.".format(
+        num_encoded - len(encoded_constraints), num_subsumed))
+
+    # The constraint clauses are all binary: merge equivalent variables, fix
+    # forced ones and catch contradictions before calling pycosat at all.
+    with timing.span("simplify") as fields:
+        substitution = simplify_binary_clauses(clauses)
+        if substitution is not None:
+            clauses = list(substitution.apply_all(clauses))
+            fields.update(fixed = len(substitution.fixed), merged = len(substitution.equivalent))
+    if substitution is None:
+        print("The constraints contradict each other, falling back to MaxSAT.")
+        return maxsat(num_wizards, num_constraints, wizards, constraints, data, remaining_time(deadline, processing_start), report)
+    print("2-SAT simplification fixed {} and merged {} of {} variables, leaving {} constraint clauses.".format(
+        len(substitution.fixed), len(substitution.equivalent), len(variables), len(clauses)))
     if DEBUG:
-        print("Clauses (first 100):\n", clauses[:100])
+        print("Constraint clauses (first 100):\n", clauses[:100])
 
     # Solve using pycosat.
-    pycosat_input = [clause.to_pycosat(variables) for clause in clauses]
     algorithm_start = time.time()
     print("Calling Pycosat to solve the problem.")
-    pycosat_output = pycosat.solve(pycosat_input)
+    if lazy:
+        with timing.span("solve_lazily"):
+            ordering = solve_lazily(variables, clauses, encoded_constraints, substitution)
+    else:
+        # Add 3-Term clauses to prevent loops. These are generated lazily, while
+        # pycosat reads them, so the full clause list is never held in memory.
+        transitivity = substitution.apply_all(transitivity_clauses(variables))
+        cnf = itertools.chain(clauses, transitivity)
+        if timing.recorder is not None:
+            cnf = timing.timed_clauses(cnf)
+        pycosat_output = pycosat.solve(cnf, vars = len(variables))
+        if timing.recorder is not None:
+            cnf.record(timing.now(), variables = len(variables), satisfiable = pycosat_output != "UNSAT")
+        if DEBUG:
+            print("Pycosat Assignments:\n", pycosat_output)
+        ordering = None
+        if pycosat_output != "UNSAT":
+            with timing.span("decode"):
+                ordering = decode_ordering(variables, substitution.expand(pycosat_output, len(variables)))
+    if ordering is None:
+        print("Pycosat found the constraints unsatisfiable, falling back to MaxSAT.")
+        return maxsat(num_wizards, num_constraints, wizards, constraints, data, remaining_time(deadline, processing_start), report)
     print("Pycosat returned an assignment.")
     algorithm_duration = round(time.time() - algorithm_start, 2)
 
-    # Decode pycosat solution.
-    assignments = {}
-    for assignment in pycosat_output:
-        assignments[abs(assignment)] = True if assignment >= 0 else False
-    if DEBUG:
-        print("Pycosat Assignments:\n", pycosat_output)
-
     # Find a valid ordering of wizards.
-    solution = []
-    for wizard in wizards:
-        target_index = 0
-        for i in range(len(solution)):
-            variable = Variable(solution[i], wizard)
-            value = assignments[variables.encode_variable(variable)]
-            if variable.wizard1 != solution[i]:
-                value = not value
-            if value:
-                target_index = i + 1
-        solution.insert(target_index, wizard)
+    solution = [wizards[i] for i in ordering]
     if DEBUG:
         print("Solution:", solution)
-    
+
     # Completion info.
     processing_duration = round(time.time() - processing_start - algorithm_duration, 2)
     print("Solver complete. Algorithm took {} seconds. Processing took {} seconds.".format(algorithm_duration, processing_duration))
     return solution
 
+def maxsat(num_wizards, num_constraints, wizards, constraints, data = None, deadline = None, report = None):
+    # Give every constraint a relaxation variable that switches its clauses off
+    # and look for orderings that relax fewer and fewer constraints: after each
+    # ordering with v violations, require at most v - 1 relaxed constraints.
+    # Stops once that is unsatisfiable (the last ordering is optimal) or the
+    # deadline (in seconds) has passed; every improvement is passed to report().
+    # Without a starting ordering, a quick SAT call with no relaxations (or
+    # else a short local search) provides the first bound.
+    algorithm_start = time.time()
+    if DEBUG:
+        print("Input with {} wizards and {} constraints.".format(len(wizards), len(constraints)))
+    random.shuffle(wizards)
+    with timing.span("encode_constraints") as fields:
+        encoded_constraints = encode_constraints(wizards, constraints)
+        fields["constraints"] = len(encoded_constraints)
+    with timing.span("variable_list") as fields:
+        variables = VariableList(len(wizards))
+        relaxations = list(range(len(variables) + 1, len(variables) + len(encoded_constraints) + 1))
+        fields["variables"] = len(variables) + len(relaxations)
+    with timing.span("transitivity_clauses") as fields:
+        hard_clauses = list(transitivity_clauses(variables))
+        fields["clauses"] = len(hard_clauses)
+    with timing.span("constraint_clauses") as fields:
+        for triplet, relaxation in zip(encoded_constraints, relaxations):
+            for clause in Constraint(triplet).to_clause(variables):
+                hard_clauses.append(clause + [relaxation])
+        fields["clauses"] = 2 * len(encoded_constraints)
+
+    best, best_violations = None, len(encoded_constraints) + 1
+    if data is None and encoded_constraints:
+        # A quick try at satisfying every constraint, with all relaxations off.
+        with timing.span("sat", clauses = len(hard_clauses), bound = 0) as fields:
+            pycosat_output = pycosat.solve(hard_clauses + [[-relaxation] for relaxation in relaxations], prop_limit = 1000000)
+            fields["result"] = pycosat_output if isinstance(pycosat_output, str) else "SAT"
+        if not isinstance(pycosat_output, str):
+            data = [wizards[i] for i in decode_ordering(variables, pycosat_output)]
+    if data is None and encoded_constraints:
+        with timing.span("seed") as fields:
+            search = InsertionSearch(wizards, constraints)
+            search.steps, search.stall_steps = 100 * len(encoded_constraints), 5000
+            timer = None
+            if deadline is not None:
+                # Leave most of the deadline to the SAT calls.
+                search.stop_event = threading.Event()
+                timer = threading.Timer(deadline / 4, search.stop_event.set)
+                timer.start()
+            data, fields["violations"] = search.anneal()
+            if timer is not None:
+                timer.cancel()
+    if data is not None:
+        encoder = {k: v for v, k in enumerate(wizards)}
+        best = [encoder[wizard] for wizard in data]
+        best_violations = count_violations(best, encoded_constraints)
+        print("Starting with ordering where {} constraints are violated.".format(best_violations))
+        if report is not None:
+            report(list(data), best_violations)
+    prop_limit = 1000000
+    while best_violations > 0:
+        remaining = None
+        if deadline is not None:
+            remaining = algorithm_start + deadline - time.time()
+            if remaining <= 0:
+                print("MaxSAT deadline reached.")
+                break
+        cnf = hard_clauses
+        if best_violations <= len(encoded_constraints):
+            cnf = hard_clauses + at_most_clauses(relaxations, best_violations - 1, relaxations[-1] + 1)
+        call_start = time.time()
+        with timing.span("sat", clauses = len(cnf), bound = best_violations - 1) as fields:
+            pycosat_output = pycosat.solve(cnf, prop_limit = prop_limit if deadline is not None else 0)
+            fields["result"] = pycosat_output if isinstance(pycosat_output, str) else "SAT"
+        call_duration = time.time() - call_start
+        if pycosat_output == "UNKNOWN":
+            # pycosat.solve() can't be interrupted, so only allow a call twice
+            # as long as the last one if that still fits before the deadline.
+            remaining -= call_duration
+            if 2 * call_duration < remaining:
+                prop_limit *= 2
+            elif call_duration >= remaining:
+                print("MaxSAT deadline reached.")
+                break
+            continue
+        if pycosat_output == "UNSAT":
+            print("No ordering violates fewer than {} constraints.".format(best_violations))
+            break
+        with timing.span("decode"):
+            best = decode_ordering(variables, pycosat_output)
+        best_violations = count_violations(best, encoded_constraints)
+        print("Found ordering where {} constraints are violated ({} seconds).".format(best_violations, round(time.time() - algorithm_start, 2)))
+        if report is not None:
+            report([wizards[i] for i in best], best_violations)
+
+    # Completion info.
+    algorithm_duration = round(time.time() - algorithm_start, 2)
+    print("Solver complete. Algorithm took {} seconds.".format(algorithm_duration))
+    return [wizards[i] for i in best] if best is not None else list(wizards)
+
+# Largest number of wizards freed in one repair round, and how many fixed
+# wizards a free wizard may initially move past in either direction.
+REPAIR_MAX_FREE = 40
+REPAIR_WINDOW = 10
+
+def repair(num_wizards, num_constraints, wizards, constraints, data = None, radius = 2):
+    # Large-neighbourhood repair of a starting ordering that violates only a
+    # few constraints. Each round takes a batch of violated constraints and
+    # frees their wizards and every wizard within `radius` positions of them
+    # (up to REPAIR_MAX_FREE wizards), keeps the relative order of all other
+    # wizards, and lets pycosat place the free ones so that the batch and every
+    # constraint that is satisfied now are satisfied. Rounds repeat until no
+    # constraint is violated. A batch that can't be repaired is shrunk to one
+    # constraint, whose window and then neighbourhood are widened.
+    if data is None:
+        print("Repair needs a starting ordering, solving from scratch instead.")
+        return solve(num_wizards, num_constraints, wizards, constraints)
+    algorithm_start = time.time()
+    ordering = list(data)
+    print("Starting with ordering where {} constraints are violated.".format(count_solution_violations(ordering, constraints)))
+
+    def neighbourhood(constraint, width):
+        positions = set()
+        for position in constraint:
+            positions.update(range(max(0, position - width), min(len(ordering), position + width + 1)))
+        return positions
+
+    rounds = 0
+    while True:
+        # Wizards are encoded by their position in the current ordering.
+        encoded_constraints = encode_constraints(ordering, constraints)
+        violated = [i for i, (a, b, mid) in enumerate(encoded_constraints) if (a < mid < b) or (b < mid < a)]
+        if not violated:
+            break
+        rounds += 1
+        random.shuffle(violated)
+        batch, free = set(), set()
+        for i in violated:
+            nearby = neighbourhood(encoded_constraints[i], radius)
+            if free and len(free | nearby) > REPAIR_MAX_FREE:
+                break
+            free |= nearby
+            batch.add(i)
+        width, window = radius, REPAIR_WINDOW
+        while True:
+            with timing.span("repair", free = len(free), batch = len(batch), window = window) as fields:
+                result = repair_neighbourhood(len(ordering), encoded_constraints, free, window, set(violated) - batch)
+                fields["satisfiable"] = result is not None
+            if result is not None:
+                break
+            if len(free) == len(ordering) and window >= len(ordering):
+                print("No ordering satisfies the constraints, falling back to MaxSAT.")
+                # maxsat() shuffles its wizards, so don't hand it the start ordering for those.
+                return maxsat(num_wizards, num_constraints, list(ordering), constraints, ordering)
+            # Retry a single constraint, letting its wizards move further and,
+            # once they can move anywhere, freeing more wizards.
+            if window < len(ordering):
+                window *= 2
+            else:
+                width = 2 * width + 1
+            batch = set([violated[0]])
+            free = neighbourhood(encoded_constraints[violated[0]], width)
+        ordering = [ordering[i] for i in result]
+
+    # Completion info.
+    algorithm_duration = round(time.time() - algorithm_start, 2)
+    print("Repair complete after {} rounds. Algorithm took {} seconds.".format(rounds, algorithm_duration))
+    return ordering
+
+def repair_neighbourhood(num_wizards, constraints, free, window, ignored = ()):
+    # Wizards are integers in their current order. The fixed wizards keep
+    # their order, and every free wizard is placed in a slot between two of
+    # them, at most `window` slots from where it is now. Only pairs whose order
+    # that leaves open get a variable; the order of all other pairs is a
+    # constant. Returns the new order of the wizards, or None if no placement
+    # satisfies every constraint but those whose indices are in `ignored`.
+    fixed = [wizard for wizard in range(num_wizards) if wizard not in free]
+    free = sorted(free)
+    # For a fixed wizard: its index in `fixed`. For a free wizard: the range
+    # of slots it may go in, slot k being right before fixed[k].
+    index = [None] * num_wizards
+    for k, wizard in enumerate(fixed):
+        index[wizard] = k
+    slots = {}
+    for wizard in free:
+        slot = bisect.bisect_left(fixed, wizard)
+        slots[wizard] = (max(0, slot - window), min(len(fixed), slot + window))
+    variables = {}
+
+    def negate(literal):
+        return (not literal) if isinstance(literal, bool) else -literal
+
+    def before(i, j):
+        # Literal for "i comes before j", or a bool if the order is decided.
+        if i in slots:
+            lo, hi = slots[i]
+            if j in slots:
+                lo_j, hi_j = slots[j]
+                if hi < lo_j:
+                    return True
+                if hi_j < lo:
+                    return False
+            else:
+                k = index[j]
+                if k >= hi:
+                    return True
+                if k < lo:
+                    return False
+        elif j in slots:
+            return negate(before(j, i))
+        else:
+            return i < j
+        key = (i, j) if i < j else (j, i)
+        variable = variables.get(key)
+        if variable is None:
+            variable = variables[key] = len(variables) + 1
+        return variable if i < j else -variable
+
+    clauses = []
+    def add(literals):
+        clause = []
+        for literal in literals:
+            if literal is True:
+                return True
+            if literal is not False:
+                clause.append(literal)
+        clauses.append(clause)
+        return len(clause) > 0
+
+    with timing.span("repair_encode") as fields:
+        # A free wizard that comes before a fixed one comes before all later
+        # fixed ones too; this covers every triple with one free wizard.
+        for wizard in free:
+            lo, hi = slots[wizard]
+            for k in range(lo, hi - 1):
+                add([negate(before(wizard, fixed[k])), before(wizard, fixed[k + 1])])
+        # Transitivity for the triples with two or three free wizards, whose
+        # slot ranges overlap (otherwise their order is already decided).
+        for f, g in itertools.combinations(free, 2):
+            if isinstance(before(f, g), bool):
+                continue
+            lo = min(slots[f][0], slots[g][0])
+            hi = max(slots[f][1], slots[g][1])
+            for x in itertools.chain(fixed[max(0, lo - 1):hi + 1], (x for x in free if x > g)):
+                add([negate(before(f, g)), negate(before(g, x)), negate(before(x, f))])
+                add([before(f, g), before(g, x), before(x, f)])
+        # Constraints with a free wizard (the others are already satisfied).
+        satisfiable = True
+        for i, (a, b, mid) in enumerate(constraints):
+            if (a in slots or b in slots or mid in slots) and i not in ignored:
+                satisfiable &= add([before(a, mid), before(mid, b)])
+                satisfiable &= add([before(b, mid), before(mid, a)])
+        fields.update(variables = len(variables), clauses = len(clauses))
+    if not satisfiable:
+        return None
+    with timing.span("sat", variables = len(variables)):
+        pycosat_output = pycosat.solve(clauses, vars = len(variables))
+    if pycosat_output == "UNSAT":
+        return None
+
+    true = set(literal for literal in pycosat_output if literal > 0)
+    def compare(i, j):
+        literal = before(i, j)
+        if isinstance(literal, bool):
+            return -1 if literal else 1
+        return -1 if (abs(literal) in true) == (literal > 0) else 1
+    return sorted(range(num_wizards), key = functools.cmp_to_key(compare))
+
 class WizardSolver(simanneal.Annealer):
     Tmax = 80               # Max (starting) temperature (over-written below)
     Tmin = 0.001            # Min (ending) temperature
     steps = 10000000         # Number of iterations
-    updates = steps / 100   # Number of updates (by default an update prints to stdout)
+    updates = 0             # Number of updates (telemetry samples, see update())
+    copy_strategy = "slice" # The state is a flat list of wizard names
+    stall_steps = None      # Stop after this many steps without improvement (None to disable)
+    stop_event = None       # Stop early once this event is set by another chain
+    checkpoint = None       # Save progress to this Checkpoint now and then (None to disable)
+    telemetry = None        # Record progress samples in this Telemetry (None to disable)
 
     def __init__(self, wizards, constraints):
         self.constraints = constraints
         self.Tmax = 10 + math.sqrt(len(constraints))
-        super(WizardSolver, self).__init__(wizards) 
+        super(WizardSolver, self).__init__(wizards)
+        # Index of the constraints each wizard takes part in, so that a swap
+        # only needs to re-check the constraints touching the swapped wizards.
+        self.wizard_constraints = {}
+        for i, constraint in enumerate(constraints):
+            for wizard in set(constraint):
+                self.wizard_constraints.setdefault(wizard, []).append(i)
+        self.sync()
+        self.reset_progress()
+
+    def reset_progress(self):
+        self.steps_taken = 0
+        self.last_improvement = 0
+        self.best_violations = self.violations
+        self.user_exit = False
+
+    def track_progress(self):
+        # Stop the annealer once every constraint is satisfied or the search stalls.
+        self.steps_taken += 1
+        if self.violations < self.best_violations:
+            self.best_violations = self.violations
+            self.last_improvement = self.steps_taken
+        if self.violations == 0:
+            self.user_exit = True
+        elif self.stall_steps and self.steps_taken - self.last_improvement >= self.stall_steps:
+            self.user_exit = True
+        elif self.stop_event is not None and self.steps_taken % 1000 == 0 and self.stop_event.is_set():
+            self.user_exit = True
+        if self.checkpoint is not None and self.steps_taken % 1000 == 0 and self.checkpoint.due():
+            T = self.Tmax * math.exp(-math.log(self.Tmax / self.Tmin) * self.steps_taken / self.steps)
+            self.checkpoint.save(self.best_state, self.best_energy, self.steps_taken, T)
+
+    def sync(self):
+        # Rebuild the cached positions and violation count from scratch.
+        self.positions = {k: v for v, k in enumerate(self.state)}
+        self.violations = sum(1 for i in range(len(self.constraints)) if self.violated(i))
+        self.synced_state = self.state
+        self.last_move = None
+
+    def violated(self, i):
+        c = self.constraints[i]
+        m = self.positions
+        wiz_a = m[c[0]]
+        wiz_b = m[c[1]]
+        wiz_mid = m[c[2]]
+        return (wiz_a < wiz_mid < wiz_b) or (wiz_b < wiz_mid < wiz_a)
+
+    def restore(self):
+        # simanneal rejects a move by replacing self.state with a copy of the
+        # previous state. If that is what happened, undo our last swap in the
+        # cache instead of rebuilding it.
+        if self.last_move is not None:
+            a, b, wiz_a, wiz_b, delta = self.last_move
+            if self.state[a] == wiz_a and self.state[b] == wiz_b:
+                self.positions[wiz_a] = a
+                self.positions[wiz_b] = b
+                self.violations -= delta
+                self.synced_state = self.state
+                self.last_move = None
+                return
+        self.sync()
 
     def move(self):
+        if self.state is not self.synced_state:
+            self.restore()
         a = random.randint(0, len(self.state) - 1)
         b = random.randint(0, len(self.state) - 1)
-        self.state[a], self.state[b] = self.state[b], self.state[a]
-    
+        wiz_a, wiz_b = self.state[a], self.state[b]
+        if a == b:
+            self.last_move = None
+            self.track_progress()
+            return 0
+        touched = set(self.wizard_constraints.get(wiz_a, ()))
+        touched.update(self.wizard_constraints.get(wiz_b, ()))
+        before = sum(1 for i in touched if self.violated(i))
+        self.state[a], self.state[b] = wiz_b, wiz_a
+        self.positions[wiz_a], self.positions[wiz_b] = b, a
+        delta = sum(1 for i in touched if self.violated(i)) - before
+        self.violations += delta
+        self.last_move = (a, b, wiz_a, wiz_b, delta)
+        self.track_progress()
+        return delta
+
+    def energy(self):
+        if self.state is not self.synced_state:
+            self.sync()
+        return self.violations
+
+    def update(self, step, T, E, acceptance, improvement):
+        # simanneal calls this `updates` times per run. Record a sample
+        # instead of printing a progress line (run_annealer() takes the one
+        # at step 0).
+        if self.telemetry is not None and step > 0:
+            self.telemetry.sample(step, T, E, self.best_energy, acceptance, improvement)
+
+    def anneal(self):
+        self.energy()
+        self.reset_progress()
+        result = super(WizardSolver, self).anneal()
+        self.sync()
+        return result
+
+class NativeAnnealer(object):
+    Tmax = 80               # Max (starting) temperature (over-written below)
+    Tmin = 0.001            # Min (ending) temperature
+    steps = 10000000        # Number of iterations
+    stall_steps = None      # Stop after this many steps without improvement (None to disable)
+    stop_event = None       # Stop early once this event is set by another chain
+    checkpoint = None       # Save progress to this Checkpoint now and then (None to disable)
+    telemetry = None        # Record progress samples in this Telemetry (None to disable)
+
+    def __init__(self, wizards, constraints):
+        # Wizards are encoded as integers: self.wizards[i] is the name of wizard i.
+        self.wizards = list(wizards)
+        encoder = {k: v for v, k in enumerate(self.wizards)}
+        self.constraints = [(encoder[c[0]], encoder[c[1]], encoder[c[2]]) for c in constraints]
+        self.Tmax = 10 + math.sqrt(len(constraints))
+        self.wizard_constraints = [[] for _ in self.wizards]
+        for i, constraint in enumerate(self.constraints):
+            for wizard in set(constraint):
+                self.wizard_constraints[wizard].append(i)
+        # state[i] is the wizard at position i, positions[w] is the position of wizard w.
+        self.state = array.array("i", range(len(self.wizards)))
+        self.positions = array.array("i", range(len(self.wizards)))
+        self.best_state = array.array("i", self.state)
+        self.best_energy = self.energy()
+        self.steps_taken = 0
+        self.steps_per_second = None
+
+    def violated(self, i):
+        a, b, mid = self.constraints[i]
+        p = self.positions
+        return (p[a] < p[mid] < p[b]) or (p[b] < p[mid] < p[a])
+
+    def energy(self):
+        return count_violations(self.state, self.constraints)
+
+    def anneal(self):
+        n = len(self.state)
+        state, positions, best_state = self.state, self.positions, self.best_state
+        constraints, wizard_constraints = self.constraints, self.wizard_constraints
+        rand, exp = random.random, math.exp
+
+        def count_violated(touched):
+            count = 0
+            for i in touched:
+                a, b, mid = constraints[i]
+                pa, pb, pm = positions[a], positions[b], positions[mid]
+                if (pa < pm < pb) or (pb < pm < pa):
+                    count += 1
+            return count
+
+        start = time.time()
+        E = self.energy()
+        best_state[:] = state
+        self.best_energy = E
+        Tmax, steps = self.Tmax, self.steps
+        stall_steps = self.stall_steps or steps
+        Tfactor = -math.log(self.Tmax / self.Tmin)
+        last_improvement = 0
+        step = 0
+        stop_event, checkpoint, telemetry = self.stop_event, self.checkpoint, self.telemetry
+        # Accepted and improving moves since the last telemetry sample.
+        sample_every = telemetry.every(steps) if telemetry is not None else None
+        accepts = improves = 0
+        while step < steps and E > 0 and step - last_improvement < stall_steps:
+            step += 1
+            if stop_event is not None and step % 1000 == 0 and stop_event.is_set():
+                break
+            if checkpoint is not None and step % 1000 == 0 and checkpoint.due():
+                checkpoint.save([self.wizards[w] for w in best_state], self.best_energy, step, Tmax * exp(Tfactor * step / steps))
+            if telemetry is not None and step % sample_every == 0:
+                telemetry.sample(step, Tmax * exp(Tfactor * step / steps), E, self.best_energy, accepts / sample_every, improves / sample_every)
+                accepts = improves = 0
+            a = int(rand() * n)
+            b = int(rand() * n)
+            if a == b:
+                continue
+            wiz_a, wiz_b = state[a], state[b]
+            touched = set(wizard_constraints[wiz_a])
+            touched.update(wizard_constraints[wiz_b])
+            before = count_violated(touched)
+            state[a], state[b] = wiz_b, wiz_a
+            positions[wiz_a], positions[wiz_b] = b, a
+            dE = count_violated(touched) - before
+            if dE > 0:
+                T = Tmax * exp(Tfactor * step / steps)
+                if exp(-dE / T) < rand():
+                    # Undo the swap in place.
+                    state[a], state[b] = wiz_a, wiz_b
+                    positions[wiz_a], positions[wiz_b] = a, b
+                    continue
+            accepts += 1
+            if dE < 0:
+                improves += 1
+            E += dE
+            if E < self.best_energy:
+                best_state[:] = state
+                self.best_energy = E
+                last_improvement = step
+        self.steps_taken = step
+        self.steps_per_second = step / max(time.time() - start, 1e-9)
+
+        # Leave the solver in its best state.
+        state[:] = best_state
+        for position, wizard in enumerate(state):
+            positions[wizard] = position
+        return [self.wizards[w] for w in best_state], self.best_energy
+
+class InsertionSearch(object):
+    # Local search over orderings: take a wizard from a violated constraint out
+    # of the ordering and put it back where it violates the fewest of its
+    # constraints. Only the moved wizard's constraints can change status (the
+    # others keep their relative order), so one sweep over them finds the best
+    # position. Recently moved wizards are tabu, and with walk_probability a
+    # wizard is put back at a random position instead, to escape plateaus.
+    Tmax = None             # Unused, set by run_annealer() like for the annealers
+    steps = 100000          # Number of moves (over-written below)
+    stall_steps = None      # Stop after this many moves without improvement (None to disable)
+    stop_event = None       # Stop early once this event is set by another chain
+    checkpoint = None       # Save progress to this Checkpoint now and then (None to disable)
+    telemetry = None        # Record progress samples in this Telemetry (None to disable)
+    walk_probability = 0.05
+    tabu_tenure = 10
+
+    def __init__(self, wizards, constraints):
+        # Wizards are encoded as integers: self.wizards[i] is the name of wizard i.
+        self.wizards = list(wizards)
+        encoder = {k: v for v, k in enumerate(self.wizards)}
+        self.constraints = [(encoder[c[0]], encoder[c[1]], encoder[c[2]]) for c in constraints]
+        self.wizard_constraints = [[] for _ in self.wizards]
+        for i, constraint in enumerate(self.constraints):
+            # Constraints naming a wizard twice can never be violated.
+            if len(set(constraint)) == 3:
+                for wizard in constraint:
+                    self.wizard_constraints[wizard].append(i)
+        # state[i] is the wizard at position i, positions[w] is the position of wizard w.
+        self.state = list(range(len(self.wizards)))
+        self.positions = list(range(len(self.wizards)))
+        self.steps_taken = 0
+        self.steps_per_second = None
+
+    def violated(self, i):
+        a, b, mid = self.constraints[i]
+        p = self.positions
+        return (p[a] < p[mid] < p[b]) or (p[b] < p[mid] < p[a])
+
+    def energy(self):
+        return count_violations(self.state, self.constraints)
+
+    def insertion_costs(self, wizard):
+        # costs[s] is the number of the wizard's constraints that are violated
+        # if it is taken out and inserted in slot s, i.e. before the wizard
+        # that is then at position s (slot n - 1 is the end).
+        n = len(self.state)
+        positions, constraints = self.positions, self.constraints
+        own = positions[wizard]
+        diff = [0] * (n + 1)
+        for i in self.wizard_constraints[wizard]:
+            a, b, mid = constraints[i]
+            if mid == wizard:
+                pa, pb = positions[a], positions[b]
+                pa -= pa > own
+                pb -= pb > own
+                if pa > pb:
+                    pa, pb = pb, pa
+                # Violated between the endpoints: slots pa + 1 .. pb.
+                diff[pa + 1] += 1
+                diff[pb + 1] -= 1
+            else:
+                other = b if a == wizard else a
+                po, pm = positions[other], positions[mid]
+                po -= po > own
+                pm -= pm > own
+                if pm < po:
+                    # Violated on the far side of mid: slots 0 .. pm.
+                    diff[0] += 1
+                    diff[pm + 1] -= 1
+                else:
+                    # Violated on the far side of mid: slots pm + 1 .. n - 1.
+                    diff[pm + 1] += 1
+                    diff[n] -= 1
+        return list(itertools.accumulate(diff[:n]))
+
+    def move(self, wizard, slot):
+        state, positions = self.state, self.positions
+        own = positions[wizard]
+        del state[own]
+        state.insert(slot, wizard)
+        for position in range(min(own, slot), max(own, slot) + 1):
+            positions[state[position]] = position
+
+    def reset_violations(self):
+        # Violated constraints, in a list for random picks and a dict of their
+        # indices in it for constant-time removal.
+        self.violated_list = [i for i in range(len(self.constraints)) if self.violated(i)]
+        self.violated_index = {c: k for k, c in enumerate(self.violated_list)}
+
+    def update_violations(self, wizard):
+        # Only the moved wizard's constraints can have changed status.
+        violated, index = self.violated_list, self.violated_index
+        for i in self.wizard_constraints[wizard]:
+            if self.violated(i):
+                if i not in index:
+                    index[i] = len(violated)
+                    violated.append(i)
+            elif i in index:
+                k = index.pop(i)
+                last = violated.pop()
+                if last != i:
+                    violated[k] = last
+                    index[last] = k
+
+    def set_state(self, state):
+        self.state = list(state)
+        for position, wizard in enumerate(self.state):
+            self.positions[wizard] = position
+
+    def anneal(self):
+        n = len(self.state)
+        constraints = self.constraints
+        rand, randrange, choice = random.random, random.randrange, random.choice
+        start = time.time()
+        self.reset_violations()
+        violated = self.violated_list
+        best_state, best_energy = list(self.state), len(violated)
+        steps = self.steps
+        stall_steps = self.stall_steps or steps
+        tabu_until = [0] * n
+        last_improvement = 0
+        step = 0
+        stop_event, checkpoint, telemetry = self.stop_event, self.checkpoint, self.telemetry
+        # Moves made and moves that lowered the violations since the last
+        # telemetry sample. There is no temperature.
+        sample_every = telemetry.every(steps) if telemetry is not None else None
+        accepts = improves = 0
+        while step < steps and violated and step - last_improvement < stall_steps:
+            step += 1
+            if stop_event is not None and step % 1000 == 0 and stop_event.is_set():
+                break
+            if checkpoint is not None and step % 1000 == 0 and checkpoint.due():
+                checkpoint.save([self.wizards[w] for w in best_state], best_energy, step, self.Tmax)
+            if telemetry is not None and step % sample_every == 0:
+                telemetry.sample(step, None, len(violated), best_energy, accepts / sample_every, improves / sample_every)
+                accepts = improves = 0
+            constraint = constraints[choice(violated)]
+            candidates = [wizard for wizard in constraint if tabu_until[wizard] <= step] or list(constraint)
+            if rand() < self.walk_probability:
+                wizard, slot = choice(candidates), randrange(n)
+            else:
+                # Best (wizard, slot) over the constraint's wizards, ties broken at random.
+                best = None
+                for wizard in candidates:
+                    costs = self.insertion_costs(wizard)
+                    own = self.positions[wizard]
+                    delta = min(costs) - costs[own]
+                    slots = [s for s, cost in enumerate(costs) if cost - costs[own] == delta and s != own]
+                    if slots and (best is None or delta < best[0]):
+                        best = (delta, wizard, choice(slots))
+                if best is None:
+                    continue
+                delta, wizard, slot = best
+            energy = len(violated)
+            self.move(wizard, slot)
+            tabu_until[wizard] = step + self.tabu_tenure
+            self.update_violations(wizard)
+            accepts += 1
+            if len(violated) < energy:
+                improves += 1
+            if len(violated) < best_energy:
+                best_state, best_energy = list(self.state), len(violated)
+                last_improvement = step
+        self.steps_taken = step
+        self.steps_per_second = step / max(time.time() - start, 1e-9)
+
+        # Leave the search in its best state.
+        self.set_state(best_state)
+        return [self.wizards[w] for w in best_state], best_energy
+
+class ParallelTempering(object):
+    # Replica exchange: several orderings are searched side by side, each at a
+    # fixed temperature of a geometric ladder from Tmin up to hottest. Every
+    # exchange_interval moves, neighbouring replicas swap temperatures with
+    # the Metropolis probability min(1, exp((E_i - E_j) * (1 / T_i - 1 / T_j))),
+    # so good orderings drift down to the cold end and stuck ones get reheated.
+    # A move takes a wizard of a violated constraint out and reinserts it at a
+    # slot drawn with probability proportional to exp(-violations / T), using
+    # InsertionSearch's costs: greedy when cold, close to random when hot.
+    # steps counts moves of all replicas together.
+    Tmax = None             # Unused, set by run_annealer() like for the annealers
+    Tmin = 0.2              # Coldest temperature
+    steps = 100000          # Number of moves, summed over all replicas (over-written below)
+    stall_steps = None      # Stop after this many moves without improvement (None to disable)
+    stop_event = None       # Stop early once this event is set by another chain
+    checkpoint = None       # Save progress to this Checkpoint now and then (None to disable)
+    telemetry = None        # Record progress samples in this Telemetry (None to disable)
+    replicas = 8            # Number of replicas (temperatures)
+    exchange_interval = 10  # Moves per replica between two rounds of exchanges
+    hottest = 1.0           # Hottest temperature. The ladder doesn't follow run_annealer()'s
+                            # Tmax: that is meant for swap moves, and drops to 0.01 for
+                            # near-solved starts, which would put every replica at Tmin
+
+    def __init__(self, wizards, constraints):
+        self.search = InsertionSearch(wizards, constraints)
+        self.wizards = self.search.wizards
+        self.state = self.search.state
+        self.steps_taken = 0
+        self.steps_per_second = None
+
     def energy(self):
-        output_ordering_set = set(self.state)
-        output_ordering_map = {k: v for v, k in enumerate(self.state)}
-        not_satisfied = 0
-        for constraint in self.constraints:
-            c = constraint # Creating an alias for easy reference
-            m = output_ordering_map # Creating an alias for easy reference
-            wiz_a = m[c[0]]
-            wiz_b = m[c[1]]
-            wiz_mid = m[c[2]]
-            if (wiz_a < wiz_mid < wiz_b) or (wiz_b < wiz_mid < wiz_a):
-                not_satisfied += 1
-        return not_satisfied
-
-def anneal(num_wizards, num_constraints, wizards, constraints, data = None):
+        return count_violations(self.state, self.search.constraints)
+
+    def temperatures(self):
+        if self.replicas == 1:
+            return [self.Tmin]
+        ratio = (max(self.hottest, self.Tmin) / self.Tmin) ** (1.0 / (self.replicas - 1))
+        return [self.Tmin * ratio ** k for k in range(self.replicas)]
+
+    def anneal(self):
+        n = len(self.state)
+        rand, randrange, choice, choices, exp = random.random, random.randrange, random.choice, random.choices, math.exp
+        start = time.time()
+        slots = range(n)
+
+        # Every replica starts from the given ordering; ladder[k] is the
+        # replica currently at temperature k.
+        replicas = []
+        for _ in range(self.replicas):
+            # Replicas share the search's constraints but not its ordering.
+            replica = copy.copy(self.search)
+            replica.positions = list(self.search.positions)
+            replica.set_state(self.state)
+            replica.reset_violations()
+            replicas.append(replica)
+        ladder = list(range(self.replicas))
+        temperatures = self.temperatures()
+        best_state, best_energy = list(self.state), len(replicas[0].violated_list)
+
+        steps = self.steps
+        stall_steps = self.stall_steps or steps
+        last_improvement = 0
+        step = 0
+        exchanges = accepted_exchanges = 0
+        stop_event, telemetry = self.stop_event, self.telemetry
+        # Telemetry is sampled after the first round that reaches the next
+        # sample step. Its temperature and energy are those of the coldest
+        # replica, its acceptance is that of the exchanges and its
+        # improvement the share of moves that lowered a replica's violations.
+        sample_every = telemetry.every(steps) if telemetry is not None else None
+        next_sample = sample_every
+        moves = improves = 0
+        sampled_exchanges = sampled_accepted = 0
+        while step < steps and best_energy > 0 and step - last_improvement < stall_steps:
+            if stop_event is not None and stop_event.is_set():
+                break
+            for k, T in enumerate(temperatures):
+                replica = replicas[ladder[k]]
+                for _ in range(self.exchange_interval):
+                    if not replica.violated_list:
+                        break
+                    wizard = choice(replica.constraints[choice(replica.violated_list)])
+                    costs = replica.insertion_costs(wizard)
+                    lowest = min(costs)
+                    slot = choices(slots, [exp((lowest - cost) / T) for cost in costs])[0]
+                    moves += 1
+                    if slot != replica.positions[wizard]:
+                        energy = len(replica.violated_list)
+                        replica.move(wizard, slot)
+                        replica.update_violations(wizard)
+                        if len(replica.violated_list) < energy:
+                            improves += 1
+                    if len(replica.violated_list) < best_energy:
+                        best_state, best_energy = list(replica.state), len(replica.violated_list)
+                        last_improvement = step
+                step += self.exchange_interval
+                if best_energy == 0:
+                    break
+
+            # Offer every pair of neighbouring temperatures an exchange.
+            for k in range(len(temperatures) - 1):
+                cold, hot = ladder[k], ladder[k + 1]
+                exchanges += 1
+                delta = (len(replicas[cold].violated_list) - len(replicas[hot].violated_list)) * (1.0 / temperatures[k] - 1.0 / temperatures[k + 1])
+                if delta >= 0 or exp(delta) > rand():
+                    ladder[k], ladder[k + 1] = hot, cold
+                    accepted_exchanges += 1
+            if self.checkpoint is not None and self.checkpoint.due():
+                self.checkpoint.save([self.wizards[w] for w in best_state], best_energy, step, self.hottest)
+            if telemetry is not None and step >= next_sample:
+                acceptance = (accepted_exchanges - sampled_accepted) / (exchanges - sampled_exchanges) if exchanges > sampled_exchanges else None
+                telemetry.sample(step, temperatures[0], len(replicas[ladder[0]].violated_list), best_energy, acceptance, improves / max(moves, 1))
+                next_sample = step + sample_every
+                moves = improves = 0
+                sampled_exchanges, sampled_accepted = exchanges, accepted_exchanges
+        self.steps_taken = step
+        self.steps_per_second = step / max(time.time() - start, 1e-9)
+        if DEBUG:
+            print("Replica exchange accepted {} of {} exchanges.".format(accepted_exchanges, exchanges))
+
+        # Leave the solver in its best state.
+        self.search.set_state(best_state)
+        self.state = self.search.state
+        return [self.wizards[w] for w in best_state], best_energy
+
+def annealing_schedule(num_wizards, num_constraints, energy):
+    # Scale the step budget with the size of the instance: every step only
+    # touches a couple of wizards, so larger instances need proportionally
+    # more of them to mix.
+    steps = int(min(10000000, max(100000, 200 * num_wizards * num_constraints)))
+    stall_steps = max(50000, steps // 5)
+    # Starting orderings that already satisfy most constraints are only refined.
+    Tmax = 10 + math.sqrt(num_constraints)
+    if energy < 0.2 * num_constraints:
+        Tmax = 1
+    if energy < 0.05 * num_constraints:
+        Tmax = 0.5
+    if energy < 0.02 * num_constraints:
+        Tmax = 0.01
+    return Tmax, steps, stall_steps
+
+def run_annealer(start_state, constraints, engine = "simanneal", stop_event = None, verbose = True, checkpoint = None, replicas = None):
+    resumed = None
+    if checkpoint is not None:
+        key = SolutionCache.key(start_state, constraints)
+        resumed = checkpoint.resume(key, engine)
+        if resumed is not None:
+            if resumed["step"] >= resumed["steps"]:
+                print("Checkpoint has a finished run where {} constraints are violated.".format(resumed["violations"]))
+                return resumed["ordering"], resumed["violations"], 0, 0
+            print("Resuming from checkpoint at step {} of {}.".format(resumed["step"], resumed["steps"]))
+            start_state = resumed["ordering"]
+    solver = ANNEALING_ENGINES[engine](start_state, constraints)
+    if verbose:
+        print("Starting with ordering where {} constrains are violated.".format(solver.energy()))
+    solver.Tmax, solver.steps, solver.stall_steps = annealing_schedule(len(start_state), len(constraints), solver.energy())
+    if resumed is not None:
+        # Go on with the rest of the saved run's schedule.
+        solver.Tmax, solver.steps = resumed["temperature"], resumed["steps"] - resumed["step"]
+    solver.stop_event = stop_event
+    if replicas is not None and hasattr(solver, "replicas"):
+        solver.replicas = max(1, replicas)
+    solver.telemetry = telemetry.start(engine = engine, wizards = len(start_state), constraints = len(constraints), steps = solver.steps)
+    if hasattr(solver, "updates"):
+        solver.updates = solver.telemetry.size - 2 if solver.telemetry is not None else 0
+    if solver.telemetry is not None:
+        # The start and end samples have no temperature.
+        solver.telemetry.sample(0, None, solver.energy(), solver.energy())
+    annealing_start = time.time()
+    with contextlib.ExitStack() as stack:
+        if checkpoint is not None:
+            stack.enter_context(checkpoint.handling_signals())
+            checkpoint.start(key, engine = engine, steps = solver.steps)
+            solver.checkpoint = checkpoint
+        with timing.span("anneal", engine = engine) as fields:
+            solution, num_constraints_failed = solver.anneal()
+            fields.update(steps = solver.steps_taken, violations = num_constraints_failed)
+        if checkpoint is not None:
+            # Mark the run as finished, so that resuming just returns its result.
+            checkpoint.save(solution, num_constraints_failed, solver.steps, None)
+    if solver.telemetry is not None:
+        solver.telemetry.sample(solver.steps_taken, None, num_constraints_failed, num_constraints_failed)
+        telemetry.finish(solver.telemetry)
+    annealing_duration = time.time() - annealing_start
+    steps_per_second = int(solver.steps_taken / max(annealing_duration, 1e-9))
+    return solution, num_constraints_failed, solver.steps_taken, steps_per_second
+
+def perturb(ordering, swaps):
+    ordering = list(ordering)
+    for _ in range(swaps):
+        a = random.randint(0, len(ordering) - 1)
+        b = random.randint(0, len(ordering) - 1)
+        ordering[a], ordering[b] = ordering[b], ordering[a]
+    return ordering
+
+# Set in every worker of the multi-start pool, so that the first chain to
+# satisfy all constraints can tell the others to stop.
+chain_stop_event = None
+
+def init_chain_worker(stop_event):
+    global chain_stop_event
+    chain_stop_event = stop_event
+
+def anneal_chain(wizards, constraints, data, engine, seed, replicas = None):
+    # One independent annealing chain: its own seed and its own start, either
+    # a fresh shuffle or a perturbed copy of the given starting ordering.
+    random.seed(seed)
+    if data is not None:
+        start_state = perturb(data, max(1, len(data) // 10))
+    else:
+        start_state = list(wizards)
+        random.shuffle(start_state)
+    result = run_annealer(start_state, constraints, engine, chain_stop_event, verbose = False, replicas = replicas)
+    if result[1] == 0:
+        chain_stop_event.set()
+    return result
+
+def anneal_chains(wizards, constraints, data, engine, chains, replicas = None):
+    stop_event = multiprocessing.Event()
+    best = None
+    with concurrent.futures.ProcessPoolExecutor(max_workers = chains, initializer = init_chain_worker, initargs = (stop_event,)) as executor:
+        futures = [executor.submit(anneal_chain, wizards, constraints, data, engine, random.randrange(2 ** 32), replicas) for _ in range(chains)]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if DEBUG:
+                print("Chain finished with {} violated constraints after {} steps.".format(result[1], result[2]))
+            if best is None or result[1] < best[1]:
+                best = result
+            if best[1] == 0:
+                stop_event.set()
+    return best
+
+def anneal(num_wizards, num_constraints, wizards, constraints, data = None, engine = "simanneal", chains = 1, checkpoint = None, replicas = None):
     # Pre-processing.
     algorithm_start = time.time()
     if DEBUG:
@@ -200,41 +1378,269 @@ def anneal(num_wizards, num_constraints, wizards, constraints, data = None):
     random.shuffle(wizards)
 
     # Start simulated annealing.
-    start_state = data if data is not None else wizards
-    solver = WizardSolver(start_state, constraints)
-    print("Starting with ordering where {} constrains are violated.".format(solver.energy()))
-    if solver.energy() < 100:
-        solver.Tmax = 1
-    if solver.energy() < 25:
-        solver.Tmax = 0.5
-    if solver.energy() < 10:
-        solver.Tmax = 0.01
-    solution, num_constraints_failed = solver.anneal()
-    
+    if chains > 1:
+        print("Starting {} independent annealing chains.".format(chains))
+        solution, num_constraints_failed, steps, steps_per_second = anneal_chains(wizards, constraints, data, engine, chains, replicas)
+    else:
+        start_state = data if data is not None else wizards
+        solution, num_constraints_failed, steps, steps_per_second = run_annealer(start_state, constraints, engine, checkpoint = checkpoint, replicas = replicas)
+
     # Completion info.
     algorithm_duration = round(time.time() - algorithm_start, 2)
-    print("\nSolver complete. Algorithm took {} seconds.".format(algorithm_duration))
+    print("\nSolver complete. Algorithm took {} seconds and {} steps ({} engine, {} steps/sec).".format(algorithm_duration, steps, engine, steps_per_second))
     return solution
 
+ANNEALING_ENGINES = {
+    "simanneal": WizardSolver,
+    "native": NativeAnnealer,
+    "insertion": InsertionSearch,
+    "tempering": ParallelTempering,
+}
+
+def count_solution_violations(solution, constraints):
+    return count_violations(list(range(len(solution))), encode_constraints(solution, constraints))
+
+def race_worker(results, stop_event, engine, wizards, constraints, data, seed, replicas = None):
+    # One member of the portfolio: the SAT solver, or an annealing chain that
+    # stops (and still reports its best ordering) once stop_event is set.
+    if engine == "sat":
+        random.seed(seed)
+        solution = solve(len(wizards), len(constraints), list(wizards), constraints, data)
+        results.put((engine, solution, count_solution_violations(solution, constraints)))
+    else:
+        init_chain_worker(stop_event)
+        solution, violations, steps, steps_per_second = anneal_chain(wizards, constraints, data, engine, seed, replicas)
+        results.put((engine, solution, violations))
+
+def portfolio(num_wizards, num_constraints, wizards, constraints, data = None, engine = "native", annealers = 1, deadline = None, replicas = None):
+    # Race the SAT solver against `annealers` annealing chains, each in its own
+    # process. The first ordering that satisfies every constraint wins and the
+    # other workers are killed. Once the deadline (in seconds) passes, the
+    # annealers are asked to stop and the best ordering reported is returned.
+    algorithm_start = time.time()
+    results = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    engines = ["sat"] + [engine] * annealers
+    workers = [multiprocessing.Process(target = race_worker, args = (results, stop_event, name, wizards, constraints, data, random.randrange(2 ** 32), replicas)) for name in engines]
+    for worker in workers:
+        worker.start()
+
+    best = None
+    pending = len(workers)
+    pending_annealers = annealers
+    cutoff = None
+    while pending:
+        # Poll, so that workers that died without reporting are noticed.
+        timeout = 0.5
+        if cutoff is not None:
+            timeout = min(timeout, max(0, cutoff - time.time()))
+        elif deadline is not None:
+            timeout = min(timeout, max(0, algorithm_start + deadline - time.time()))
+        try:
+            name, solution, violations = results.get(timeout = timeout)
+        except queue.Empty:
+            if cutoff is not None and time.time() >= cutoff:
+                break
+            if cutoff is None and deadline is not None and time.time() >= algorithm_start + deadline:
+                # Deadline reached: give the annealers a moment to report their best.
+                print("Portfolio deadline reached.")
+                stop_event.set()
+                cutoff = time.time() + 5
+                continue
+            if not any(worker.is_alive() for worker in workers) and results.empty():
+                print("Every portfolio worker exited, {} without reporting an ordering.".format(pending))
+                break
+            continue
+        pending -= 1
+        if name != "sat":
+            pending_annealers -= 1
+        if DEBUG:
+            print("Portfolio worker {} finished with {} violated constraints.".format(name, violations))
+        if best is None or violations < best[2]:
+            best = (name, solution, violations)
+        if violations == 0 or (cutoff is not None and pending_annealers == 0):
+            break
+    stop_event.set()
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+
+    # Completion info.
+    algorithm_duration = round(time.time() - algorithm_start, 2)
+    if best is None:
+        print("\nNo portfolio worker finished. Algorithm took {} seconds.".format(algorithm_duration))
+        return list(data) if data is not None else list(wizards)
+    print("\nSolver complete. Algorithm took {} seconds ({} won with {} violated constraints).".format(algorithm_duration, best[0], best[2]))
+    return best[1]
+
+"""
+======================================================================
+   Preprocessing happens below this line.
+======================================================================
+"""
+
+def split_components(wizards, constraints):
+    # Split the wizards into the connected components of the constraint
+    # hypergraph. Returns a list of (wizards, constraints) pairs.
+    parent = {wizard: wizard for wizard in wizards}
+    def find(wizard):
+        while parent[wizard] != wizard:
+            parent[wizard] = parent[parent[wizard]]
+            wizard = parent[wizard]
+        return wizard
+    for constraint in constraints:
+        root = find(constraint[0])
+        for wizard in constraint[1:]:
+            other = find(wizard)
+            if other != root:
+                parent[other] = root
+    components = {}
+    for wizard in wizards:
+        components.setdefault(find(wizard), ([], []))[0].append(wizard)
+    for constraint in constraints:
+        components[find(constraint[0])][1].append(constraint)
+    return list(components.values())
+
+def solve_component(method, arguments, end = None, report = None):
+    # Calls method on one part of the input. With an end time (a time.time()
+    # value), it gets only what is left of the deadline when it starts.
+    options = {}
+    if end is not None:
+        options["deadline"] = max(0, end - time.time())
+    if report is not None:
+        options["report"] = report
+    return method(*arguments, **options)
+
+def report_component(report, board, index, solution, violations):
+    # Passes an improvement of one component on as an ordering of the whole
+    # input: the best orderings known of all the components, concatenated in
+    # the order solve_decomposed() returns them. The total violations are only
+    # known once every component has reported.
+    board[index] = (list(solution), violations)
+    entries = [board[i] for i in range(len(board))]
+    counts = [count for ordering, count in entries]
+    total = None if None in counts else sum(counts)
+    report([wizard for ordering, count in entries for wizard in ordering], total)
+
+def report_peeled(report, peeled, solution, violations):
+    # Passes an improvement of the kernel on as an ordering of the whole input.
+    report(peeled + list(solution), violations)
+
+def solve_decomposed(method, num_wizards, num_constraints, wizards, constraints, data = None, processes = 1, deadline = None, report = None):
+    # Solve every connected component on its own and concatenate the orderings:
+    # no constraint spans two components, so each stays satisfied. Components
+    # with fewer than DECOMPOSE_INLINE_SIZE wizards are solved in this process,
+    # the larger ones in parallel worker processes. A method that starts
+    # `processes` processes of its own gets fewer workers, and all components
+    # share one deadline.
+    end = time.time() + deadline if deadline is not None else None
+    with timing.span("split_components") as fields:
+        components = split_components(wizards, constraints)
+        fields["components"] = len(components)
+    if len(components) == 1:
+        return solve_component(method, (num_wizards, num_constraints, wizards, constraints, data), end, report)
+    print("Split into {} independent components of sizes {}.".format(len(components), sorted((len(c[0]) for c in components), reverse = True)))
+    def arguments(component):
+        component_wizards, component_constraints = component
+        component_data = None
+        if data is not None:
+            members = set(component_wizards)
+            component_data = [wizard for wizard in data if wizard in members]
+        return len(component_wizards), len(component_constraints), component_wizards, component_constraints, component_data
+    large = [c for c in components if len(c[0]) >= DECOMPOSE_INLINE_SIZE]
+    small = [c for c in components if len(c[0]) < DECOMPOSE_INLINE_SIZE]
+    workers = min(len(large), max(1, (os.cpu_count() or 1) // processes))
+    solution = []
+    with contextlib.ExitStack() as stack:
+        # The best ordering known of every component, starting from the
+        # start state, for report_component(). Shared through a manager
+        # process when the components are solved in worker processes.
+        board = None
+        if report is not None:
+            board = stack.enter_context(multiprocessing.Manager()).dict() if workers > 1 else {}
+            for index, component in enumerate(large + small):
+                board[index] = (arguments(component)[4] or component[0], None)
+        def component_report(index):
+            if report is None:
+                return None
+            return functools.partial(report_component, report, board, index)
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+                futures = [executor.submit(solve_component, method, arguments(component), end, component_report(index))
+                           for index, component in enumerate(large)]
+                for future in futures:
+                    solution.extend(future.result())
+        else:
+            for index, component in enumerate(large):
+                solution.extend(solve_component(method, arguments(component), end, component_report(index)))
+        for index, component in enumerate(small, len(large)):
+            solution.extend(solve_component(method, arguments(component), end, component_report(index)))
+    return solution
+
+def peel_wizards(wizards, constraints):
+    # A wizard that is never an endpoint of a constraint can go first in the
+    # ordering: then it is not between any two wizards. Its constraints are
+    # satisfied whatever happens, so drop them and repeat with the wizards that
+    # are no longer endpoints of anything. Returns the remaining kernel of
+    # wizards and constraints and the peeled wizards in the order they were removed.
+    endpoint_count = {wizard: 0 for wizard in wizards}
+    middle_of = {wizard: [] for wizard in wizards}
+    for i, (a, b, mid) in enumerate(constraints):
+        endpoint_count[a] += 1
+        endpoint_count[b] += 1
+        middle_of[mid].append(i)
+    active = [True] * len(constraints)
+    peeled = []
+    stack = [wizard for wizard in wizards if endpoint_count[wizard] == 0]
+    while stack:
+        wizard = stack.pop()
+        peeled.append(wizard)
+        for i in middle_of[wizard]:
+            if not active[i]:
+                continue
+            active[i] = False
+            for endpoint in constraints[i][:2]:
+                endpoint_count[endpoint] -= 1
+                if endpoint_count[endpoint] == 0:
+                    stack.append(endpoint)
+    removed = set(peeled)
+    kernel_wizards = [wizard for wizard in wizards if wizard not in removed]
+    kernel_constraints = [constraints[i] for i in range(len(constraints)) if active[i]]
+    return kernel_wizards, kernel_constraints, peeled
+
+def solve_peeled(method, num_wizards, num_constraints, wizards, constraints, data = None, deadline = None, report = None):
+    # Solve only the kernel left by peel_wizards(). Every peeled wizard goes in
+    # front of all the wizards that were still there when it was removed, which
+    # includes the endpoints of all of its constraints.
+    with timing.span("peel") as fields:
+        kernel_wizards, kernel_constraints, peeled = peel_wizards(wizards, constraints)
+        fields["peeled"] = len(peeled)
+    end = time.time() + deadline if deadline is not None else None
+    if not peeled:
+        return solve_component(method, (num_wizards, num_constraints, wizards, constraints, data), end, report)
+    print("Peeled {} wizards, leaving {} wizards and {} constraints.".format(len(peeled), len(kernel_wizards), len(kernel_constraints)))
+    if not kernel_wizards:
+        return peeled
+    kernel_data = None
+    if data is not None:
+        members = set(kernel_wizards)
+        kernel_data = [wizard for wizard in data if wizard in members]
+    if report is not None:
+        report = functools.partial(report_peeled, report, peeled)
+    return peeled + solve_component(method, (len(kernel_wizards), len(kernel_constraints), kernel_wizards, kernel_constraints, kernel_data), end, report)
+
 """
 ======================================================================
    Input parsing happens below this line.
 ======================================================================
 """
 
-def read_input(filename):
-    with open(filename) as f:
-        num_wizards = int(f.readline())
-        num_constraints = int(f.readline())
-        constraints = []
-        wizards = set()
-        for _ in range(num_constraints):
-            c = f.readline().split()
-            constraints.append(c)
-            for w in c:
-                wizards.add(w)
-    wizards = list(wizards)
-    return num_wizards, num_constraints, wizards, constraints
+def read_input(filename, cache_dir = None):
+    with timing.span("parse") as fields:
+        instance = load_instance(filename, cache_dir)
+        fields.update(wizards = instance.num_wizards, constraints = instance.num_constraints)
+    return instance.num_wizards, instance.num_constraints, list(instance.names), instance.constraint_names()
 
 def write_output(filename, solution):
     with open(filename, "w") as f:
@@ -252,6 +1658,203 @@ def natural_keys(text):
     '''
     return [atoi(c) for c in re.split('(\d+)', text)]
 
+"""
+======================================================================
+   Batch solving happens below this line.
+======================================================================
+"""
+
+def output_path(input_file, output, phase3 = False):
+    if not os.path.isdir(output):
+        return output
+    file_name = os.path.split(input_file)[1].replace(".in", ".out")
+    if not phase3:
+        file_name = file_name.replace("input", "output")
+    return os.path.join(output, file_name)
+
+def valid_solutions(pairs, instance_cache = None):
+    # Returns which (input_file, output_file) pairs already have an output
+    # file satisfying every constraint, validating them in a single batch.
+    existing = [(input_file, output_file) for input_file, output_file in pairs if os.path.isfile(output_file)]
+    results = output_validator.processBatch(existing, instance_cache)
+    return set((result["input"], result["output"]) for result in results if result["error"] is None and result["failed"] == 0)
+
+def has_valid_solution(input_file, output_file, instance_cache = None):
+    return (input_file, output_file) in valid_solutions([(input_file, output_file)], instance_cache)
+
+def solver_method(use_anneal = False, engine = "simanneal", chains = 1, lazy = False, use_maxsat = False, use_portfolio = False, deadline = None, decompose = True, peel = True, report = None, repair_radius = None, checkpoint = None, replicas = None):
+    # Builds the function that solve_file() (and benchmark.py) call as
+    # method(num_wizards, num_constraints, wizards, constraints, start_state).
+    # Portfolio, maxsat and solve take a deadline, and maxsat and solve report
+    # their improvements. Both are passed on at call time, so that
+    # solve_decomposed() can share the deadline among the components, and it
+    # and solve_peeled() can expand the improvements to the whole input.
+    # `processes` counts the processes each call of the method starts.
+    timed = True
+    reports = False
+    processes = 1
+    if use_portfolio:
+        method = functools.partial(portfolio, engine = engine, annealers = chains, replicas = replicas)
+        processes = 1 + chains
+    elif use_maxsat:
+        method = maxsat
+        reports = True
+    elif repair_radius is not None:
+        method = functools.partial(repair, radius = repair_radius)
+        timed = False
+    elif use_anneal:
+        method = functools.partial(anneal, engine = engine, chains = chains, checkpoint = checkpoint, replicas = replicas)
+        timed = False
+        processes = chains
+    else:
+        method = functools.partial(solve, lazy = lazy)
+        reports = True
+    if decompose:
+        method = functools.partial(solve_decomposed, method, processes = processes)
+    if peel:
+        method = functools.partial(solve_peeled, method)
+    if timed and deadline is not None:
+        method = functools.partial(method, deadline = deadline)
+    if reports and report is not None:
+        method = functools.partial(method, report = report)
+    return method
+
+def report_improvement(output_file, num_wizards, solution, violations):
+    # solve_peeled() and solve_decomposed() expand improvements to orderings
+    # of the whole instance; anything shorter is not written out. A
+    # module-level function, so that methods using it can be sent to the
+    # decomposition's worker processes.
+    if len(solution) == num_wizards:
+        write_output(output_file, solution)
+
+def solve_file(input_file, output_file, use_anneal = False, engine = "simanneal", chains = 1, lazy = False, use_maxsat = False, use_portfolio = False, deadline = None, decompose = True, peel = True, cache = None, instance_cache = None, start_state = None, repair_radius = None, checkpoint_interval = None, replicas = None):
+    telemetry.current_input = input_file
+    with timing.span("file", file = input_file):
+        num_wizards, num_constraints, wizards, constraints = read_input(input_file, instance_cache)
+        solve_start = time.time()
+        if cache is not None:
+            cached = cache.get(wizards, constraints)
+            if cached is not None:
+                # Check the cached ordering against this input before trusting it.
+                checked = output_validator.processBatch([(input_file, cached["ordering"])], instance_cache)[0]
+                if checked["error"] is not None:
+                    print("Ignoring cached ordering for {}: {}".format(input_file, checked["error"]))
+                    cache.discard(wizards, constraints)
+                    cached = None
+                elif checked["failed"] == 0:
+                    print("File {} found in the solution cache.".format(input_file))
+                    write_output(output_file, cached["ordering"])
+                    return 0
+                elif checked["failed"] != cached["violations"]:
+                    print("Cached ordering for {} violates {} constraints, not {}.".format(input_file, checked["failed"], cached["violations"]))
+                    cache.discard(wizards, constraints)
+                    cached["violations"] = checked["failed"]
+            if cached is not None and start_state is None:
+                print("Starting from cached ordering where {} constraints are violated.".format(cached["violations"]))
+                start_state = cached["ordering"]
+        print("Solving file: {} ({} wizards, {} constraints)".format(input_file, num_wizards, num_constraints))
+        report = functools.partial(report_improvement, output_file, len(wizards))
+        # Annealing progress is saved next to the output, and picked up again
+        # by the next run on the same file. Only a single chain of annealing
+        # (solver_method() picks portfolio, maxsat and repair over it) saves any.
+        checkpoint = None
+        if checkpoint_interval and use_anneal and chains == 1 and not use_portfolio and not use_maxsat and repair_radius is None:
+            checkpoint = Checkpoint(output_file + ".checkpoint", checkpoint_interval)
+        method = solver_method(use_anneal, engine, chains, lazy, use_maxsat, use_portfolio, deadline, decompose, peel, report, repair_radius, checkpoint, replicas)
+        solution = method(num_wizards, num_constraints, wizards, constraints, start_state)
+        write_output(output_file, solution)
+        if checkpoint is not None:
+            checkpoint.remove()
+        with timing.span("validate"):
+            result = output_validator.processBatch([(input_file, solution)], instance_cache)[0]
+        if result["error"] is not None:
+            print("Solution file {} is not a valid ordering: {}".format(output_file, result["error"]))
+            return num_constraints
+        if result["failed"] == 0:
+            print("Solution file {} verified!".format(output_file))
+        else:
+            print("Solution file {} did not satisfy {}/{} constraints.".format(output_file, result["failed"], result["total"]))
+        if cache is not None:
+            cache.put(wizards, constraints, solution, result["failed"], time.time() - solve_start)
+        return result["failed"]
+
+def solve_file_in_group(input_file, output_file, **options):
+    # Worker process of solve_batch(). It leads its own process group, so that
+    # the chain, portfolio and decomposition workers it starts can be killed
+    # together with it. Being out of the terminal's group, it doesn't get the
+    # terminal's Ctrl-C either: solve_batch() passes that on.
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    return solve_file(input_file, output_file, **options)
+
+def kill_group(process, signum = signal.SIGTERM):
+    try:
+        os.killpg(process.pid, signum)
+    except ProcessLookupError:
+        # The worker didn't get to create its group yet.
+        os.kill(process.pid, signum)
+
+def raise_interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+def solve_batch(tasks, jobs, time_limit = None, **options):
+    # Solve (input_file, output_file) pairs in up to `jobs` worker processes,
+    # killing any worker that runs for longer than `time_limit` seconds.
+    # Returns a list of (input_file, status, duration) tuples.
+    pending = list(reversed(tasks))
+    running = {}
+    results = []
+    # SIGTERM stops the batch like Ctrl-C does.
+    previous = signal.signal(signal.SIGTERM, raise_interrupt)
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                input_file, output_file = pending.pop()
+                process = multiprocessing.Process(target = solve_file_in_group, args = (input_file, output_file), kwargs = options)
+                process.start()
+                running[process] = (input_file, output_file, time.time())
+            time.sleep(0.1)
+            for process, (input_file, output_file, started) in list(running.items()):
+                duration = time.time() - started
+                if process.is_alive():
+                    if time_limit is None or duration < time_limit:
+                        continue
+                    kill_group(process)
+                    process.join()
+                    print("File {} timed out after {} seconds.".format(input_file, round(duration, 2)))
+                    status = "timed out"
+                else:
+                    process.join()
+                    status = "solved" if has_valid_solution(input_file, output_file, options.get("instance_cache")) else "unsolved"
+                del running[process]
+                results.append((input_file, status, duration))
+    except KeyboardInterrupt:
+        # Interrupt every worker's group, so that annealing workers save their
+        # checkpoints, and give them a moment to do so.
+        print("Interrupted, stopping {} workers.".format(len(running)))
+        for process in running:
+            kill_group(process, signal.SIGINT)
+        for process in running:
+            process.join(10)
+            if process.is_alive():
+                kill_group(process, signal.SIGKILL)
+                process.join()
+        raise
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    return results
+
+def print_summary(results):
+    print("\nBatch summary:")
+    for input_file, status, duration in results:
+        print("  {:<60} {:<10} {:>8.2f}s".format(input_file, status, duration))
+    counts = {}
+    for _, status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    print("{} solved, {} unsolved, {} timed out, {} skipped ({} seconds of solving).".format(
+        counts.get("solved", 0), counts.get("unsolved", 0), counts.get("timed out", 0), counts.get("skipped", 0),
+        round(sum(duration for _, _, duration in results), 2)))
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Constraint Solver.")
     parser.add_argument(
@@ -267,15 +1870,122 @@ if __name__ == "__main__":
         dest="anneal",
         action="store_true",
         help="use simulated annealing instead of 3SAT")
+    parser.add_argument(
+        "--replicas",
+        dest="replicas",
+        type=int,
+        default=ParallelTempering.replicas,
+        help="number of replicas (temperatures) of --engine tempering")
+    parser.add_argument(
+        "--local-search", "-l",
+        dest="local_search",
+        action="store_true",
+        help="use best-insertion local search instead of 3SAT (same as --anneal --engine insertion)")
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=sorted(ANNEALING_ENGINES),
+        default="simanneal",
+        help="annealing engine to use with --anneal (tempering runs --replicas replicas in one process)")
+    parser.add_argument(
+        "--chains",
+        dest="chains",
+        type=int,
+        default=1,
+        help="number of independent annealing chains to run in parallel with --anneal")
+    parser.add_argument(
+        "--lazy",
+        dest="lazy",
+        action="store_true",
+        help="add the 3SAT anti-cycle clauses on demand instead of all up front (for large, sparse inputs)")
+    parser.add_argument(
+        "--maxsat",
+        dest="maxsat",
+        action="store_true",
+        help="find an ordering with as few violated constraints as possible")
+    parser.add_argument(
+        "--portfolio",
+        dest="portfolio",
+        action="store_true",
+        help="race 3SAT against --chains annealers (using --engine) and keep the first valid ordering")
+    parser.add_argument(
+        "--deadline",
+        dest="deadline",
+        type=float,
+        help="stop --maxsat or --portfolio (or the MaxSAT fallback of unsatisfiable inputs) after this many seconds and keep the best ordering found")
+    parser.add_argument(
+        "--no-decompose",
+        dest="decompose",
+        action="store_false",
+        help="solve the whole input at once instead of each independent group of wizards separately")
+    parser.add_argument(
+        "--no-peel",
+        dest="peel",
+        action="store_false",
+        help="keep wizards that can trivially go first in the ordering in the problem")
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        nargs="?",
+        const=".solution_cache",
+        help="reuse and store solutions in this cache directory (default: .solution_cache)")
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=int,
+        default=10000,
+        help="maximum number of instances kept in the solution cache")
+    parser.add_argument(
+        "--instance-cache",
+        dest="instance_cache",
+        help="keep binary copies of parsed inputs in this directory and load those instead")
     parser.add_argument(
         "--start",
         dest="start",
         help="use the wizard ordering in this file as the starting state")
+    parser.add_argument(
+        "--repair",
+        dest="repair_radius",
+        type=int,
+        nargs="?",
+        const=2,
+        help="repair the --start (or cached) ordering: only re-place the wizards of violated constraints and those within this many positions of them (default 2)")
     parser.add_argument(
         "--phase3",
         dest="phase3",
         action="store_true",
         help="only solve the files whose names are specified in the phase3 assignments variable")
+    parser.add_argument(
+        "--jobs", "-j",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="number of files to solve in parallel worker processes")
+    parser.add_argument(
+        "--time-limit",
+        dest="time_limit",
+        type=float,
+        help="give up on a file after this many seconds (runs each file in a worker process)")
+    parser.add_argument(
+        "--checkpoint-interval",
+        dest="checkpoint_interval",
+        type=float,
+        default=30,
+        help="save single-chain annealing progress to the OUTPUT.checkpoint directory every this many seconds and on SIGINT/SIGTERM, and resume from it when rerun (0 to disable)")
+    parser.add_argument(
+        "--trace",
+        dest="trace",
+        help="append timing spans of every solver stage to this file as JSON lines")
+    parser.add_argument(
+        "--telemetry",
+        dest="telemetry",
+        help="append samples of every annealing run's progress (energy, temperature, acceptance, steps/sec) to this file as JSON lines")
+    parser.add_argument(
+        "--telemetry-size",
+        dest="telemetry_size",
+        type=int,
+        default=1000,
+        help="number of samples taken (and kept) per annealing run with --telemetry")
     parser.add_argument(
         "--debug", "-d",
         dest="debug",
@@ -285,6 +1995,14 @@ if __name__ == "__main__":
 
     if args.debug:
         DEBUG = True
+    if args.local_search:
+        args.anneal, args.engine = True, "insertion"
+    if args.trace:
+        # Worker processes inherit the recorder. Every span is written (and
+        # flushed) as one line, so lines from different files don't interleave.
+        timing.enable(open(args.trace, "a"), keep = False)
+    if args.telemetry:
+        telemetry.enable(args.telemetry, max(1, args.telemetry_size))
 
     start_state = None
     if args.start:
@@ -305,28 +2023,30 @@ if __name__ == "__main__":
         print("Running phase3 files required that you pass in a directory where the phase3 files are stored.")
         sys.exit()
     
-    for input_file in inputs:
-        if not os.path.isdir(args.output):
-            output_file = args.output
-        else:
-            file_name = os.path.split(input_file)[1].replace(".in", ".out")
-            if not args.phase3:
-                file_name = file_name.replace("input", "output")
-            output_file = os.path.join(args.output, file_name)
-        if len(inputs) > 1 and os.path.isfile(output_file):
-            try:
-                if len(output_validator.processInput(input_file, output_file)[2]) == 0:
-                    print("File {} already has a valid solution in {}, skipping.".format(input_file, output_file))
-                    continue
-            except:
-                pass
-        num_wizards, num_constraints, wizards, constraints = read_input(input_file)
-        print("Solving file: {} ({} wizards, {} constraints)".format(input_file, num_wizards, num_constraints))
-        f = anneal if args.anneal else solve
-        solution = f(num_wizards, num_constraints, wizards, constraints, start_state)
-        write_output(output_file, solution)
-        constraints_satisfied, num_constraints, constraints_failed = output_validator.processInput(input_file, output_file)
-        if constraints_satisfied == num_constraints:
-            print("Solution file {} verified!".format(output_file))
-        else:
-            print("Solution file {} did not satisfy {}/{} constraints.".format(output_file, len(constraints_failed), num_constraints))
+    cache = SolutionCache(args.cache, args.cache_size) if args.cache else None
+    options = dict(use_anneal = args.anneal, engine = args.engine, chains = args.chains, lazy = args.lazy, use_maxsat = args.maxsat, use_portfolio = args.portfolio, deadline = args.deadline, decompose = args.decompose, peel = args.peel, cache = cache, instance_cache = args.instance_cache, start_state = start_state, repair_radius = args.repair_radius, checkpoint_interval = args.checkpoint_interval, replicas = args.replicas)
+    results = []
+    tasks = []
+    pairs = [(input_file, output_path(input_file, args.output, args.phase3)) for input_file in inputs]
+    already_valid = valid_solutions(pairs, args.instance_cache) if len(inputs) > 1 else set()
+    for input_file, output_file in pairs:
+        if (input_file, output_file) in already_valid:
+            print("File {} already has a valid solution in {}, skipping.".format(input_file, output_file))
+            results.append((input_file, "skipped", 0.0))
+            continue
+        tasks.append((input_file, output_file))
+
+    if args.jobs > 1 or args.time_limit is not None:
+        try:
+            results.extend(solve_batch(tasks, max(1, args.jobs), args.time_limit, **options))
+        except KeyboardInterrupt:
+            sys.exit(130)
+    else:
+        for input_file, output_file in tasks:
+            file_start = time.time()
+            constraints_failed = solve_file(input_file, output_file, **options)
+            status = "solved" if constraints_failed == 0 else "unsolved"
+            results.append((input_file, status, time.time() - file_start))
+
+    if len(inputs) > 1:
+        print_summary(results)
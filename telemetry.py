@@ -0,0 +1,80 @@
+import os
+import json
+import time
+
+# Samples of the annealers' progress, to tune schedules and compare engines.
+# A run samples its energy, best energy, temperature, acceptance and
+# improvement rates (over the steps since the previous sample) and steps/sec
+# into a fixed-size ring buffer, about `size` times over its step budget. At
+# the end of the run, the samples are appended to the sink file as one JSON
+# line:
+#
+#     {"input": ..., "engine": ..., "fields": ["step", ...], "samples": [[0, ...], ...]}
+#
+# Nothing is sampled until enable() is called, and the annealers only pay
+# for an "is not None" check per step while it isn't.
+
+FIELDS = ("step", "elapsed", "temperature", "energy", "best_energy", "acceptance", "improvement", "steps_per_second")
+
+class Telemetry:
+    def __init__(self, size = 1000, **labels):
+        self.size = size
+        self.labels = labels
+        self.buffer = [None] * size
+        self.count = 0
+        self.start = self.last_time = time.perf_counter()
+        self.last_step = 0
+
+    def every(self, steps):
+        # Sampling interval, in steps, for a run of this many steps. Leaves
+        # room for a sample at the start and one at the end.
+        return max(1, int(steps) // max(1, self.size - 2))
+
+    def sample(self, step, temperature, energy, best_energy, acceptance = None, improvement = None):
+        now = time.perf_counter()
+        rate = (step - self.last_step) / (now - self.last_time) if now > self.last_time else None
+        self.buffer[self.count % self.size] = (step, round(now - self.start, 6),
+                                               None if temperature is None else round(temperature, 6),
+                                               energy, best_energy,
+                                               None if acceptance is None else round(acceptance, 4),
+                                               None if improvement is None else round(improvement, 4),
+                                               None if rate is None else int(rate))
+        self.count += 1
+        self.last_step, self.last_time = step, now
+
+    def samples(self):
+        # The samples still in the buffer, oldest first.
+        if self.count <= self.size:
+            return self.buffer[:self.count]
+        head = self.count % self.size
+        return self.buffer[head:] + self.buffer[:head]
+
+    def dump(self, path):
+        run = dict(self.labels, pid = os.getpid(), dropped = max(0, self.count - self.size),
+                   fields = FIELDS, samples = self.samples())
+        # One write per run, so that runs from different worker processes don't interleave.
+        with open(path, "a") as f:
+            f.write(json.dumps(run, separators = (",", ":")) + "\n")
+
+sink = None
+size = 1000
+# The input file being solved, to label the runs.
+current_input = None
+
+def enable(path, buffer_size = 1000):
+    global sink, size
+    sink, size = path, buffer_size
+
+def disable():
+    global sink
+    sink = None
+
+def start(**labels):
+    # A Telemetry for a new run, or None if telemetry isn't enabled.
+    if sink is None:
+        return None
+    return Telemetry(size, input = current_input, **labels)
+
+def finish(telemetry):
+    if telemetry is not None and sink is not None:
+        telemetry.dump(sink)
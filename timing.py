@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import contextlib
+
+# Named timing spans for the solve pipeline. Nothing is recorded until a
+# Recorder is enabled, and span() is then close to free, so the solvers can
+# be instrumented everywhere:
+#
+#     with timing.span("sat", variables = n) as fields:
+#         output = pycosat.solve(clauses)
+#         fields["result"] = ...
+#
+# Every finished span becomes one event: its name, the names of the spans it
+# is nested in, start time, duration and any fields (counts) attached to it.
+# Events are kept in memory and, if a sink is given, also written to it as
+# JSON lines.
+
+class Recorder:
+    def __init__(self, sink = None, keep = True):
+        self.sink = sink
+        self.keep = keep
+        self.events = []
+        self.stack = []
+        self.origin = time.perf_counter()
+
+    def emit(self, name, start, duration, fields):
+        event = {"span": name, "parent": "/".join(self.stack), "start": round(start - self.origin, 6),
+                 "duration": round(duration, 6), "pid": os.getpid()}
+        event.update(fields)
+        if self.keep:
+            self.events.append(event)
+        if self.sink is not None:
+            self.sink.write(json.dumps(event) + "\n")
+            self.sink.flush()
+
+    @contextlib.contextmanager
+    def span(self, name, **fields):
+        start = time.perf_counter()
+        self.stack.append(name)
+        try:
+            yield fields
+        finally:
+            self.stack.pop()
+            self.emit(name, start, time.perf_counter() - start, fields)
+
+    def totals(self):
+        # Summed durations per span name, and summed numeric fields per
+        # "span.field" name.
+        durations, counts = {}, {}
+        for event in self.events:
+            durations[event["span"]] = durations.get(event["span"], 0) + event["duration"]
+            for key, value in event.items():
+                if key not in ("span", "parent", "start", "duration", "pid") and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    key = "{}.{}".format(event["span"], key)
+                    counts[key] = counts.get(key, 0) + value
+        return durations, counts
+
+recorder = None
+
+def enable(sink = None, keep = True):
+    global recorder
+    recorder = Recorder(sink, keep)
+    return recorder
+
+def disable():
+    global recorder
+    recorder = None
+
+@contextlib.contextmanager
+def _disabled_span(fields):
+    yield fields
+
+def span(name, **fields):
+    if recorder is None:
+        return _disabled_span(fields)
+    return recorder.span(name, **fields)
+
+def now():
+    return time.perf_counter()
+
+class timed_clauses:
+    # Wraps the clauses handed to pycosat, to split the time pycosat.solve()
+    # takes into producing the clauses (time inside the wrapped iterator),
+    # converting them into pycosat's own format (time between two clauses)
+    # and the search itself (time after the last clause was read).
+    # solve() only wraps its clauses while a Recorder is enabled.
+    def __init__(self, clauses):
+        self.clauses = iter(clauses)
+        self.count = 0
+        self.generation = 0.0
+        self.first = None
+        self.last = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        if self.first is None:
+            self.first = start
+        try:
+            clause = next(self.clauses)
+        except StopIteration:
+            self.last = time.perf_counter()
+            self.generation += self.last - start
+            raise
+        self.generation += time.perf_counter() - start
+        self.count += 1
+        return clause
+
+    def record(self, end, **fields):
+        # Adds "clause_generation", "pycosat_conversion" and "sat" spans, given
+        # the time (from now()) at which pycosat.solve() returned.
+        if recorder is None or self.first is None:
+            return
+        last = self.last if self.last is not None else end
+        recorder.emit("clause_generation", self.first, self.generation, {"clauses": self.count})
+        recorder.emit("pycosat_conversion", self.first, last - self.first - self.generation, {})
+        recorder.emit("sat", last, end - last, fields)